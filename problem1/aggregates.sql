@@ -0,0 +1,32 @@
+-- problem1/aggregates.sql
+-- Optional summary layer for Q6-Q10. load_data.py --aggregates creates it; once present the
+-- loader folds every newly loaded stop_events batch into it (rows above the watermark) and
+-- queries.py reads from it instead of scanning stop_events.
+CREATE TABLE IF NOT EXISTS agg_line_stats (
+  line_id     INTEGER PRIMARY KEY REFERENCES lines(line_id) ON DELETE CASCADE,
+  boardings   BIGINT NOT NULL DEFAULT 0,
+  alightings  BIGINT NOT NULL DEFAULT 0,
+  event_count BIGINT NOT NULL DEFAULT 0,
+  late_count  BIGINT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS agg_stop_stats (
+  stop_id     INTEGER PRIMARY KEY REFERENCES stops(stop_id) ON DELETE CASCADE,
+  boardings   BIGINT NOT NULL DEFAULT 0,
+  alightings  BIGINT NOT NULL DEFAULT 0,
+  event_count BIGINT NOT NULL DEFAULT 0,
+  late_count  BIGINT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS agg_trip_stats (
+  trip_id     VARCHAR(32) PRIMARY KEY REFERENCES trips(trip_id) ON DELETE CASCADE,
+  boardings   BIGINT NOT NULL DEFAULT 0,
+  alightings  BIGINT NOT NULL DEFAULT 0,
+  event_count BIGINT NOT NULL DEFAULT 0,
+  late_count  BIGINT NOT NULL DEFAULT 0
+);
+-- highest stop_event_id already folded into the agg_* tables
+CREATE TABLE IF NOT EXISTS agg_watermark (
+  singleton     BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+  last_event_id BIGINT NOT NULL
+);
+INSERT INTO agg_watermark(singleton, last_event_id) VALUES (TRUE, 0) ON CONFLICT DO NOTHING;
+CREATE INDEX IF NOT EXISTS idx_agg_trip_late ON agg_trip_stats(late_count);
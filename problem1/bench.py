@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# problem1/bench.py
+# Benchmarks the QUERIES registry: N timed runs after warm-up, p50/p95/p99 latency and the
+# EXPLAIN (ANALYZE, BUFFERS) plan per query, written to <outdir>/Q*.bench.json. With
+# --baseline DIR the run is compared against an earlier outdir and exits 1 on a regression.
+import argparse, json, os, sys, time
+from queries import QUERIES, connect, prepare, query_sql, run, uses_aggregates
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def explain(conn, key):
+    sql, params = query_sql(conn, key)
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        plan = [r[0] for r in cur.fetchall()]
+    conn.rollback()
+    return plan
+
+def bench_query(conn, key, runs, warmup, prepared=False):
+    for _ in range(warmup):
+        run(conn, key, prepared)
+    samples = []
+    n_rows = 0
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        n_rows = len(run(conn, key, prepared))
+        samples.append((time.perf_counter() - t0) * 1000)
+    conn.rollback()
+    ordered = sorted(samples)
+    stats = {f"p{p}": round(percentile(ordered, p), 3) for p in (50, 95, 99)}
+    stats.update(min=round(ordered[0], 3), max=round(ordered[-1], 3),
+                 mean=round(sum(ordered) / len(ordered), 3))
+    return {
+        "query": key, "description": QUERIES[key][1], "rows": n_rows,
+        "runs": runs, "warmup": warmup, "prepared": prepared, "aggregates": uses_aggregates(conn),
+        "latency_ms": stats, "samples_ms": [round(s, 3) for s in samples],
+        "plan": explain(conn, key),
+    }
+
+def compare(result, baseline, tolerance, min_delta_ms):
+    """A regression is a p95 that is both tolerance-relative and min_delta_ms-absolute slower."""
+    cur, base = result["latency_ms"]["p95"], baseline["latency_ms"]["p95"]
+    regressed = cur > base * (1 + tolerance) and cur - base > min_delta_ms
+    return {"baseline_p95": base, "p95": cur,
+            "change_pct": round((cur - base) / base * 100, 1) if base else None,
+            "regression": regressed}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--dbname', required=True)
+    ap.add_argument('--query', action='append', choices=QUERIES.keys(), help='Repeatable; default is every query')
+    ap.add_argument('--runs', type=int, default=30)
+    ap.add_argument('--warmup', type=int, default=3)
+    ap.add_argument('--prepared', action='store_true', help='Benchmark the PREPARE/EXECUTE path')
+    ap.add_argument('--label', default='', help='Free-form tag stored with the results (e.g. schema profile)')
+    ap.add_argument('--outdir', default='out', help='Where Q*.bench.json are written')
+    ap.add_argument('--baseline', help='Directory with Q*.bench.json from an earlier run to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.20, help='Allowed relative p95 slowdown vs baseline')
+    ap.add_argument('--min-delta-ms', type=float, default=0.5, help='Ignore p95 slowdowns smaller than this')
+    args = ap.parse_args()
+    keys = args.query or list(QUERIES)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    conn = connect(args.dbname)
+    regressions = []
+    try:
+        if args.prepared:
+            prepare(conn)
+        for key in keys:
+            res = bench_query(conn, key, args.runs, args.warmup, args.prepared)
+            res["label"] = args.label
+            res["recorded_at"] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            if args.baseline:
+                path = os.path.join(args.baseline, f"{key}.bench.json")
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        res["comparison"] = compare(res, json.load(f), args.tolerance, args.min_delta_ms)
+                    if res["comparison"]["regression"]:
+                        regressions.append(key)
+            with open(os.path.join(args.outdir, f"{key}.bench.json"), 'w', encoding='utf-8') as f:
+                json.dump(res, f, indent=2)
+            summary = {"query": key, "rows": res["rows"], **res["latency_ms"]}
+            if "comparison" in res:
+                summary["vs_baseline_pct"] = res["comparison"]["change_pct"]
+            print(json.dumps(summary))
+    finally:
+        conn.close()
+
+    if regressions:
+        print(f"REGRESSION (p95 > +{args.tolerance:.0%} vs baseline): {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
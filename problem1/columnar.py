@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# problem1/columnar.py
+# In-process columnar engine for the QUERIES registry (queries.py --engine columnar): the CSVs
+# in data/ are loaded into NumPy columns with the same dedupe/FK rules as load_data.py, stop,
+# line and trip names dictionary-encoded to integer codes and timestamps stored as int64 epoch
+# seconds. The encoded columns are cached as .npy files (default <datadir>/.columnar) and
+# memory-mapped on later runs; the cache is rebuilt when a CSV's size or mtime changes.
+import csv, json, os, sys, time
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from spatial import EARTH_RADIUS_M, StopIndex, bbox, nearest_params, point_params, radius_param, round_m
+
+CACHE_VERSION = 1
+SOURCES = ('lines.csv', 'stops.csv', 'line_stops.csv', 'trips.csv', 'stop_events.csv')
+LATE_SECONDS = 120  # Q8/Q9: actual > scheduled + INTERVAL '2 minutes'
+
+class Store:
+    """Column arrays by name, e.g. store['ev.stop'] or store.ev_stop. Dictionaries are the
+    *_name/trip_id arrays; every other table refers to them by position (the code)."""
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __getattr__(self, name):
+        try:
+            return self.columns[name.replace('_', '.', 1)]
+        except KeyError:
+            raise AttributeError(name) from None
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        rdr = csv.DictReader(f)
+        cols = {k: [] for k in rdr.fieldnames}
+        for row in rdr:
+            for k, v in row.items():
+                cols[k].append(v)
+    return cols
+
+def first_seen(keys):
+    """Indexes of the first occurrence of each key, in file order (ON CONFLICT DO NOTHING)."""
+    _, idx = np.unique(keys, return_index=True, axis=0)
+    return np.sort(idx)
+
+def encode(values, dictionary, what):
+    """Codes of values in dictionary; unknown names fail like the loader's missing-FK check."""
+    uniq, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    index = {name: code for code, name in enumerate(dictionary.tolist())}
+    missing = [u for u in uniq.tolist() if u not in index]
+    if missing:
+        raise ValueError(f"Missing {what} for {missing[0]}")
+    return np.array([index[u] for u in uniq.tolist()], dtype=np.int32)[inverse.reshape(-1)]
+
+def timestamps(values):
+    return np.array(values, dtype='datetime64[s]').astype(np.int64)
+
+def floats(values):
+    return np.array([float(v) if v.strip() else np.nan for v in values], dtype=np.float64)
+
+def build(datadir):
+    lines = read_csv(os.path.join(datadir, 'lines.csv'))
+    keep = first_seen(np.array(lines['line_name']))
+    line_name = np.array(lines['line_name'])[keep]
+
+    stops = read_csv(os.path.join(datadir, 'stops.csv'))
+    keep = first_seen(np.array(stops['stop_name']))
+    stop_name = np.array(stops['stop_name'])[keep]
+    lat, lon = floats(stops['latitude'])[keep], floats(stops['longitude'])[keep]
+
+    ls = read_csv(os.path.join(datadir, 'line_stops.csv'))
+    ls_line = encode(ls['line_name'], line_name, 'line_id')
+    ls_stop = encode(ls['stop_name'], stop_name, 'stop_id')
+    ls_seq = np.array(ls['sequence'], dtype=np.int32)
+    keep = first_seen(np.stack([ls_line, ls_seq], axis=1))
+
+    trips = read_csv(os.path.join(datadir, 'trips.csv'))
+    keep_trips = first_seen(np.array(trips['trip_id']))
+    trip_id = np.array(trips['trip_id'])[keep_trips]
+
+    ev = read_csv(os.path.join(datadir, 'stop_events.csv'))
+    return {
+        'line.name': line_name,
+        'stop.name': stop_name, 'stop.lat': lat, 'stop.lon': lon,
+        'ls.line': ls_line[keep], 'ls.stop': ls_stop[keep], 'ls.seq': ls_seq[keep],
+        'ls.offset': np.array(ls['time_offset'], dtype=np.int32)[keep],
+        'trip.id': trip_id,
+        'trip.line': encode(trips['line_name'], line_name, 'line_id')[keep_trips],
+        'trip.departure': timestamps(trips['scheduled_departure'])[keep_trips],
+        'ev.trip': encode(ev['trip_id'], trip_id, 'trip_id'),
+        'ev.stop': encode(ev['stop_name'], stop_name, 'stop_id'),
+        'ev.scheduled': timestamps(ev['scheduled']),
+        'ev.actual': timestamps(ev['actual']),
+        'ev.on': np.array(ev['passengers_on'], dtype=np.int32),
+        'ev.off': np.array(ev['passengers_off'], dtype=np.int32),
+    }
+
+def source_stamp(datadir):
+    stamp = {}
+    for name in SOURCES:
+        st = os.stat(os.path.join(datadir, name))
+        stamp[name] = [st.st_size, st.st_mtime_ns]
+    return {"version": CACHE_VERSION, "sources": stamp}
+
+def load(datadir='data', cache_dir=None, use_cache=True):
+    """Store for datadir, memory-mapped from cache_dir when it is current, else built from
+    the CSVs and written there (a read-only cache_dir only costs the rebuild)."""
+    cache_dir = cache_dir or os.path.join(datadir, '.columnar')
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    stamp = source_stamp(datadir)
+    if use_cache:
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest["stamp"] == stamp:
+                return Store({name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r')
+                              for name in manifest["columns"]})
+        except (OSError, ValueError, KeyError):
+            pass
+    columns = build(datadir)
+    if use_cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for name, arr in columns.items():
+                np.save(os.path.join(cache_dir, f"{name}.npy"), arr, allow_pickle=False)
+            # the manifest goes last, so a partial write is never taken for a valid cache
+            tmp = manifest_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"stamp": stamp, "columns": list(columns)}, f)
+            os.replace(tmp, manifest_path)
+        except OSError as e:
+            print(f"columnar cache not written ({e})", file=sys.stderr)
+    return Store(columns)
+
+def as_datetime(seconds):
+    return np.asarray(seconds, dtype=np.int64).astype('datetime64[s]').astype(object)
+
+def code_of(dictionary, name):
+    hit = np.flatnonzero(dictionary == name)
+    return int(hit[0]) if hit.size else None
+
+def ordered(keys_desc, names):
+    """Positions sorted by keys_desc descending, then names ascending."""
+    return np.lexsort((names, -np.asarray(keys_desc, dtype=np.int64)))
+
+def q1(db):
+    line = code_of(db.line_name, 'Route 20')
+    idx = np.flatnonzero(db.ls_line == line)
+    idx = idx[np.argsort(db.ls_seq[idx], kind='stable')]
+    return [{"stop_name": n, "sequence": s, "time_offset": o}
+            for n, s, o in zip(db.stop_name[db.ls_stop[idx]].tolist(), db.ls_seq[idx].tolist(), db.ls_offset[idx].tolist())]
+
+def q2(db):
+    tod = db.trip_departure % 86400
+    idx = np.flatnonzero((tod >= 7 * 3600) & (tod < 9 * 3600))
+    idx = idx[np.lexsort((db.trip_id[idx], db.trip_departure[idx]))]
+    return [{"trip_id": t, "line_name": l, "scheduled_departure": d}
+            for t, l, d in zip(db.trip_id[idx].tolist(), db.line_name[db.trip_line[idx]].tolist(), as_datetime(db.trip_departure[idx]))]
+
+def q3(db):
+    # stop names are unique after the loader's dedupe, so grouping by name is grouping by code
+    pairs = np.unique(db.ls_stop.astype(np.int64) * len(db.line_name) + db.ls_line)
+    line_count = np.bincount(pairs // len(db.line_name), minlength=len(db.stop_name))
+    idx = np.flatnonzero(line_count >= 2)
+    idx = idx[ordered(line_count[idx], db.stop_name[idx])]
+    return [{"stop_name": n, "line_count": c} for n, c in zip(db.stop_name[idx].tolist(), line_count[idx].tolist())]
+
+def q4(db, trip=None):
+    trip = code_of(db.trip_id, trip or os.getenv('TRIP_ID', 'T0001'))
+    idx = np.flatnonzero(db.ev_trip == trip)
+    idx = idx[np.argsort(db.ev_scheduled[idx], kind='stable')]
+    return [{"trip_id": t, "stop_name": n, "scheduled": s, "actual": a}
+            for t, n, s, a in zip(db.trip_id[db.ev_trip[idx]].tolist(), db.stop_name[db.ev_stop[idx]].tolist(),
+                                  as_datetime(db.ev_scheduled[idx]), as_datetime(db.ev_actual[idx]))]
+
+def q5(db):
+    a, b = code_of(db.stop_name, 'Wilshire / Veteran'), code_of(db.stop_name, 'Le Conte / Broxton')
+    both = np.intersect1d(db.ls_line[db.ls_stop == a], db.ls_line[db.ls_stop == b])
+    return [{"line_name": n} for n in np.sort(db.line_name[both]).tolist()]
+
+def per_line(db, weights=None):
+    line = db.trip_line[db.ev_trip]
+    if weights is None:
+        return np.bincount(line, minlength=len(db.line_name))
+    return np.bincount(line, weights=weights, minlength=len(db.line_name)).astype(np.int64)
+
+def per_stop(db, weights=None):
+    if weights is None:
+        return np.bincount(db.ev_stop, minlength=len(db.stop_name))
+    return np.bincount(db.ev_stop, weights=weights, minlength=len(db.stop_name)).astype(np.int64)
+
+def q6(db):
+    events, boardings = per_line(db), per_line(db, db.ev_on)
+    avg = {i: (Decimal(int(boardings[i])) / Decimal(int(events[i]))).quantize(Decimal('0.01'), ROUND_HALF_UP)
+           for i in np.flatnonzero(events).tolist()}
+    return [{"line_name": db.line_name[i], "avg_passengers": v}
+            for i, v in sorted(avg.items(), key=lambda kv: (-kv[1], db.line_name[kv[0]]))]
+
+def q7(db):
+    events, activity = per_stop(db), per_stop(db, db.ev_on.astype(np.int64) + db.ev_off)
+    idx = np.flatnonzero(events)
+    idx = idx[ordered(activity[idx], db.stop_name[idx])][:10]
+    return [{"stop_name": n, "total_activity": a} for n, a in zip(db.stop_name[idx].tolist(), activity[idx].tolist())]
+
+def late(db):
+    return db.ev_actual > db.ev_scheduled + LATE_SECONDS
+
+def q8(db):
+    delays = per_line(db, late(db))
+    idx = np.flatnonzero(delays)
+    idx = idx[ordered(delays[idx], db.line_name[idx])]
+    return [{"line_name": n, "delay_count": c} for n, c in zip(db.line_name[idx].tolist(), delays[idx].tolist())]
+
+def q9(db):
+    delays = np.bincount(db.ev_trip[late(db)], minlength=len(db.trip_id))
+    idx = np.flatnonzero(delays >= 3)
+    idx = idx[ordered(delays[idx], db.trip_id[idx])]
+    return [{"trip_id": t, "delayed_stop_count": c} for t, c in zip(db.trip_id[idx].tolist(), delays[idx].tolist())]
+
+def q10(db):
+    events, boardings = per_stop(db), per_stop(db, db.ev_on)
+    idx = np.flatnonzero(events)
+    # total > AVG(total), kept in integers: total * n > SUM(total)
+    idx = idx[boardings[idx] * len(idx) > boardings[idx].sum()]
+    idx = idx[ordered(boardings[idx], db.stop_name[idx])]
+    return [{"stop_name": n, "total_boardings": b} for n, b in zip(db.stop_name[idx].tolist(), boardings[idx].tolist())]
+
+def stops_near(db, lat, lon, radius_m):
+    """(positions, meters) of the stops within radius_m, nearest first then by name."""
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox(lat, lon, radius_m)
+    idx = np.flatnonzero((db.stop_lat >= lat_lo) & (db.stop_lat <= lat_hi) & (db.stop_lon >= lon_lo) & (db.stop_lon <= lon_hi))
+    p1, p2 = np.radians(lat), np.radians(db.stop_lat[idx])
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(db.stop_lon[idx] - lon) / 2) ** 2
+    meters = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    keep = meters <= radius_m
+    idx, meters = idx[keep], meters[keep]
+    order = np.lexsort((db.stop_name[idx], meters))
+    return idx[order], meters[order]
+
+def stop_rows(db, idx, meters):
+    return [{"stop_name": n, "latitude": a, "longitude": b, "distance_m": round_m(m)}
+            for n, a, b, m in zip(db.stop_name[idx].tolist(), db.stop_lat[idx].tolist(), db.stop_lon[idx].tolist(), meters.tolist())]
+
+def stop_index(db):
+    """StopIndex over the loaded stops (queries.py --engine columnar --spatial kdtree)."""
+    coord = lambda v: None if np.isnan(v) else v
+    return StopIndex((n, coord(a), coord(b)) for n, a, b in zip(db.stop_name.tolist(), db.stop_lat.tolist(), db.stop_lon.tolist()))
+
+def q11(db):
+    lat, lon = point_params()
+    n, max_radius_m = nearest_params()
+    idx, meters = stops_near(db, lat, lon, max_radius_m)
+    return stop_rows(db, idx[:n], meters[:n])
+
+def q12(db):
+    lat, lon = point_params()
+    return stop_rows(db, *stops_near(db, lat, lon, radius_param()))
+
+QUERIES = {"Q1": q1, "Q2": q2, "Q3": q3, "Q4": q4, "Q5": q5, "Q6": q6, "Q7": q7, "Q8": q8, "Q9": q9, "Q10": q10,
+           "Q11": q11, "Q12": q12}
+
+def run(db, key):
+    return QUERIES[key](db)
+
+def result(db, key, description):
+    t0 = time.time()
+    data = run(db, key)
+    return {
+        "query": key, "description": description, "results": data, "count": len(data),
+        "execution_time_ms": round((time.time()-t0)*1000,2)
+    }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# problem1/gen_data.py
+# Scales the transit dataset: lines/stops/line_stops are copied as-is, the weekly trip
+# schedule in trips.csv is repeated --scale times (one week per copy) and stop_events.csv
+# is synthesized along each line's stop sequence. Delays and passenger counts are drawn
+# from histograms of the source stop_events.csv so Q6-Q10 keep their shape. Rows are
+# written as they are generated; only the base schedule and the histograms are in memory.
+import argparse, csv, os, random, shutil, time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+FMT = '%Y-%m-%d %H:%M:%S'
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+def fit_profile(events_path):
+    """Histograms from the source events: delay at the first stop, per-stop delay growth
+    (delays only accumulate along a trip) and boardings/alightings away from the termini."""
+    first_delay, growth, on, off = Counter(), Counter(), Counter(), Counter()
+    prev_trip, prev_delay, pending = None, 0, None
+    with open(events_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            delay = int((datetime.strptime(row['actual'], FMT) - datetime.strptime(row['scheduled'], FMT)).total_seconds() // 60)
+            if row['trip_id'] != prev_trip:
+                first_delay[delay] += 1
+                pending = None
+            else:
+                growth[max(delay - prev_delay, 0)] += 1
+                if pending is not None:
+                    on[pending[0]] += 1; off[pending[1]] += 1
+                pending = (int(row['passengers_on']), int(row['passengers_off']))
+            prev_trip, prev_delay = row['trip_id'], delay
+    return {name: (list(c), list(c.values())) for name, c in
+            (('first_delay', first_delay), ('growth', growth), ('on', on), ('off', off))}
+
+def sampler(rng, hist, k):
+    values, weights = hist
+    return rng.choices(values, weights=weights, k=k)
+
+def generate(datadir, outdir, scale, seed=0):
+    os.makedirs(outdir, exist_ok=True)
+    for name in ('lines.csv', 'stops.csv', 'line_stops.csv'):
+        if os.path.abspath(os.path.join(datadir, name)) != os.path.abspath(os.path.join(outdir, name)):
+            shutil.copyfile(os.path.join(datadir, name), os.path.join(outdir, name))
+
+    route = defaultdict(list)
+    for r in read_csv(os.path.join(datadir, 'line_stops.csv')):
+        route[r['line_name']].append((int(r['sequence']), r['stop_name'], int(r['time_offset'])))
+    for stops in route.values():
+        stops.sort()
+    base = read_csv(os.path.join(datadir, 'trips.csv'))
+    first = min(datetime.strptime(t['scheduled_departure'], FMT) for t in base)
+    last = max(datetime.strptime(t['scheduled_departure'], FMT) for t in base)
+    period = timedelta(days=max((last.date() - first.date()).days + 1, 7))
+    profile = fit_profile(os.path.join(datadir, 'stop_events.csv'))
+
+    rng = random.Random(seed)
+    width = max(4, len(str(len(base) * scale)))
+    n_trips = n_events = 0
+    with open(os.path.join(outdir, 'trips.csv'), 'w', newline='', encoding='utf-8', buffering=1 << 20) as tf, \
+         open(os.path.join(outdir, 'stop_events.csv'), 'w', newline='', encoding='utf-8', buffering=1 << 20) as ef:
+        trips, events = csv.writer(tf, lineterminator='\n'), csv.writer(ef, lineterminator='\n')
+        trips.writerow(['trip_id', 'line_name', 'scheduled_departure', 'vehicle_id'])
+        events.writerow(['trip_id', 'stop_name', 'scheduled', 'actual', 'passengers_on', 'passengers_off'])
+        for week in range(scale):
+            shift = period * week
+            for t in base:
+                n_trips += 1
+                trip_id = f"T{n_trips:0{width}d}"
+                depart = datetime.strptime(t['scheduled_departure'], FMT) + shift
+                trips.writerow([trip_id, t['line_name'], depart.strftime(FMT), t['vehicle_id']])
+                stops = route[t['line_name']]
+                n = len(stops)
+                delay = sampler(rng, profile['first_delay'], 1)[0]
+                growth = sampler(rng, profile['growth'], n)
+                on = sampler(rng, profile['on'], n)
+                off = sampler(rng, profile['off'], n)
+                for i, (_, stop_name, offset) in enumerate(stops):
+                    if i:
+                        delay += growth[i]
+                    sched = depart + timedelta(minutes=offset)
+                    events.writerow([trip_id, stop_name, sched.strftime(FMT),
+                                     (sched + timedelta(minutes=delay)).strftime(FMT),
+                                     0 if i == n - 1 else on[i], 0 if i == 0 else off[i]])
+                n_events += n
+    return n_trips, n_events
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--datadir', default='data', help='Source CSVs (topology, base week of trips, events to fit)')
+    ap.add_argument('--outdir', required=True)
+    ap.add_argument('--scale', type=int, default=10, help='Number of copies of the base trip schedule')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+    t0 = time.time()
+    n_trips, n_events = generate(args.datadir, args.outdir, args.scale, args.seed)
+    dt = time.time() - t0
+    print(f"Generated trips={n_trips}, stop_events={n_events} into {args.outdir} in {dt:.1f}s "
+          f"({n_events / dt if dt > 0 else 0:,.0f} events/s)")
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 # problem1/load_data.py
-import argparse, csv, os, sys
+import argparse, csv, hashlib, io, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 import psycopg2
 
+def conn_params(args):
+    return dict(host=args.host, dbname=args.dbname, user=args.user, password=args.password, port=args.port)
+
 def connect(args):
-    conn = psycopg2.connect(
-        host=args.host, dbname=args.dbname, user=args.user, password=args.password, port=args.port
-    )
+    conn = psycopg2.connect(**conn_params(args))
     conn.autocommit = False
     return conn
 
@@ -83,7 +86,22 @@ def load_trips(conn, path, line_map):
             count += 1
     return count
 
+def scheduled_range(path):
+    lo = hi = None
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            ts = datetime.fromisoformat(row['scheduled'].strip())
+            lo = ts if lo is None or ts < lo else lo
+            hi = ts if hi is None or ts > hi else hi
+    return lo, hi
+
 def load_stop_events(conn, path, stop_map):
+    # one pass for the scheduled range first, so the rows land in their month partitions
+    if has_partitions(conn):
+        lo, hi = scheduled_range(path)
+        if lo is not None:
+            with conn.cursor() as cur:
+                cur.execute("SELECT ensure_stop_event_partitions(%s, %s)", (lo, hi))
     with conn.cursor() as cur, open(path, newline='', encoding='utf-8') as f:
         rdr = csv.DictReader(f)
         count=0
@@ -101,6 +119,365 @@ def load_stop_events(conn, path, stop_map):
             count += 1
     return count
 
+# --mode copy: each CSV is streamed via COPY into a TEMP staging table (all TEXT, plus
+# an ord column to keep file order), then name -> id resolution runs as one set-based
+# INSERT ... SELECT ... JOIN. Entry: (csv columns, (missing-FK probe, message), insert).
+BULK = {
+    'lines': (
+        ('line_name', 'vehicle_type'),
+        None,
+        """
+        INSERT INTO lines(line_name, vehicle_type)
+        SELECT line_name, vehicle_type FROM stg_lines ORDER BY ord
+        ON CONFLICT (line_name) DO NOTHING
+        """),
+    'stops': (
+        ('stop_name', 'latitude', 'longitude'),
+        None,
+        """
+        INSERT INTO stops(stop_name, latitude, longitude)
+        SELECT stop_name, NULLIF(trim(latitude), '')::double precision, NULLIF(trim(longitude), '')::double precision
+        FROM (SELECT DISTINCT ON (stop_name) * FROM stg_stops ORDER BY stop_name, ord) first_seen
+        ORDER BY ord
+        ON CONFLICT (stop_name) DO NOTHING
+        """),
+    'line_stops': (
+        ('line_name', 'stop_name', 'sequence', 'time_offset'),
+        ("""
+        SELECT st.line_name, st.stop_name FROM stg_line_stops st
+        LEFT JOIN lines l ON l.line_name = st.line_name
+        LEFT JOIN stops s ON s.stop_name = st.stop_name
+        WHERE l.line_id IS NULL OR s.stop_id IS NULL LIMIT 1
+        """, "Missing FK for line={0} stop={1}"),
+        """
+        INSERT INTO line_stops(line_id, stop_id, sequence, time_offset_minutes)
+        SELECT l.line_id, s.stop_id, st.sequence::int, st.time_offset::int
+        FROM stg_line_stops st
+        JOIN lines l ON l.line_name = st.line_name
+        JOIN stops s ON s.stop_name = st.stop_name
+        ORDER BY st.ord
+        ON CONFLICT (line_id, sequence) DO NOTHING
+        """),
+    'trips': (
+        ('trip_id', 'line_name', 'scheduled_departure', 'vehicle_id'),
+        ("""
+        SELECT st.line_name FROM stg_trips st
+        LEFT JOIN lines l ON l.line_name = st.line_name
+        WHERE l.line_id IS NULL LIMIT 1
+        """, "Missing line_id for {0}"),
+        """
+        INSERT INTO trips(trip_id, line_id, scheduled_departure, vehicle_id)
+        SELECT st.trip_id, l.line_id, st.scheduled_departure::timestamp, st.vehicle_id
+        FROM stg_trips st JOIN lines l ON l.line_name = st.line_name
+        ORDER BY st.ord
+        ON CONFLICT (trip_id) DO NOTHING
+        """),
+    'stop_events': (
+        ('trip_id', 'stop_name', 'scheduled', 'actual', 'passengers_on', 'passengers_off'),
+        ("""
+        SELECT st.stop_name FROM stg_stop_events st
+        LEFT JOIN stops s ON s.stop_name = st.stop_name
+        WHERE s.stop_id IS NULL LIMIT 1
+        """, "Missing stop_id for {0}"),
+        """
+        INSERT INTO stop_events(trip_id, stop_id, scheduled, actual, passengers_on, passengers_off)
+        SELECT st.trip_id, s.stop_id, st.scheduled::timestamp, st.actual::timestamp,
+               st.passengers_on::int, st.passengers_off::int
+        FROM stg_stop_events st JOIN stops s ON s.stop_name = st.stop_name
+        ORDER BY st.ord
+        """),
+}
+
+def has_partitions(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regproc('ensure_stop_event_partitions') IS NOT NULL")
+        return cur.fetchone()[0]
+
+def ensure_partitions(conn, source):
+    """Create the monthly stop_events partitions a staged batch needs (schema_prod.sql only)."""
+    if has_partitions(conn):
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT ensure_stop_event_partitions(MIN(scheduled::timestamp), MAX(scheduled::timestamp))
+                FROM {source} HAVING COUNT(*) > 0
+            """)
+
+def copy_load(conn, table, f):
+    cols, missing, insert = BULK[table]
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS stg_{table} (ord BIGSERIAL, "
+                    + ", ".join(f"{c} TEXT" for c in cols) + ") ON COMMIT DROP")
+        cur.execute(f"TRUNCATE stg_{table}")
+        cur.copy_expert(f"COPY stg_{table} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+        if missing:
+            cur.execute(missing[0])
+            bad = cur.fetchone()
+            if bad:
+                raise ValueError(missing[1].format(*bad))
+        if table == 'stop_events':
+            ensure_partitions(conn, 'stg_stop_events')
+        cur.execute(insert)
+        return cur.rowcount
+
+def copy_file(conn, table, path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return copy_load(conn, table, f)
+
+# --workers N: stop_events.csv is cut into byte ranges that start on line boundaries
+# (the file has no quoted newlines), each worker COPYs its chunk into a shared UNLOGGED
+# stage table on its own connection and commits it, and main() moves the stage into
+# stop_events inside its own transaction. A failed chunk aborts the whole load.
+EVENT_STAGE_DDL = """
+CREATE UNLOGGED TABLE {stage} (
+  chunk INTEGER NOT NULL, ord INTEGER NOT NULL,
+  trip_id VARCHAR(32) NOT NULL, stop_id INTEGER NOT NULL,
+  scheduled TIMESTAMP NOT NULL, actual TIMESTAMP NOT NULL,
+  passengers_on INTEGER NOT NULL, passengers_off INTEGER NOT NULL
+)
+"""
+
+def split_ranges(path, n_chunks):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        body = size - bounds[0]
+        for i in range(1, n_chunks):
+            pos = bounds[0] + body * i // n_chunks
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+        bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def event_columns(path):
+    """Position of each stop_events column in the CSV header; like the DictReader and COPY
+    paths, columns are matched by name, so order and extra columns do not matter."""
+    with open(path, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    cols = BULK['stop_events'][0]
+    missing = [c for c in cols if c not in header]
+    if missing:
+        raise ValueError(f"{os.path.basename(path)} has no column {missing[0]}")
+    return [header.index(c) for c in cols]
+
+_worker = {}
+
+def _init_worker(params, stop_map, stage, columns):
+    _worker.update(params=params, stop_map=stop_map, stage=stage, columns=columns)
+
+def load_events_chunk(chunk, path, start, end):
+    stop_map, columns = _worker['stop_map'], _worker['columns']
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    count = 0
+    for row in csv.reader(io.StringIO(text, newline='')):
+        if not row:
+            continue
+        trip_id, stop_name, scheduled, actual, p_on, p_off = (row[i] for i in columns)
+        stop_id = stop_map.get(stop_name)
+        if stop_id is None:
+            raise ValueError(f"Missing stop_id for {stop_name}")
+        out.writerow((chunk, count, trip_id, stop_id, scheduled, actual, p_on, p_off))
+        count += 1
+    buf.seek(0)
+    conn = psycopg2.connect(**_worker['params'])
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY {_worker['stage']} FROM STDIN WITH (FORMAT csv)", buf)
+        conn.commit()
+    finally:
+        conn.close()
+    return chunk, count
+
+def load_stop_events_parallel(conn, params, path, stop_map, workers, chunk_mb=64):
+    size = os.path.getsize(path)
+    n_chunks = max(workers, -(-size // (max(chunk_mb, 1) << 20)))
+    columns = event_columns(path)
+    ranges = split_ranges(path, n_chunks)
+    stage = f"stop_events_stage_{os.getpid()}"
+    admin = psycopg2.connect(**params)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {stage}")
+            cur.execute(EVENT_STAGE_DDL.format(stage=stage))
+        committed, failed = [], []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(params, stop_map, stage, columns)) as ex:
+            futs = {ex.submit(load_events_chunk, i, path, a, b): i for i, (a, b) in enumerate(ranges)}
+            for fut in as_completed(futs):
+                try:
+                    committed.append(fut.result())
+                except Exception as e:
+                    failed.append((futs[fut], e))
+        if failed:
+            done = ', '.join(f"{i}({n})" for i, n in sorted(committed)) or 'none'
+            bad = ', '.join(f"{i}: {e}" for i, e in sorted(failed, key=lambda x: x[0]))
+            raise RuntimeError(f"stop_events chunks failed [{bad}]; staged chunks [{done}] discarded")
+        print(f"  stop_events: {len(ranges)} chunks staged by {workers} workers")
+        # the swap and the stage drop ride on the caller's transaction
+        ensure_partitions(conn, stage)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO stop_events(trip_id, stop_id, scheduled, actual, passengers_on, passengers_off)
+                SELECT trip_id, stop_id, scheduled, actual, passengers_on, passengers_off
+                FROM {stage} ORDER BY chunk, ord
+            """)
+            n = cur.rowcount
+            cur.execute(f"DROP TABLE {stage}")
+        return n
+    except Exception:
+        # release the caller's locks on the stage before dropping it; main() rolls back anyway
+        conn.rollback()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {stage}")
+        raise
+    finally:
+        admin.close()
+
+# --incremental: every CSV keeps a checkpoint (bytes consumed, rows, sha256 of those
+# bytes). If the file still starts with the checkpointed bytes only the tail is loaded,
+# in batches that commit together with their checkpoint, so a crash resumes from the
+# last committed batch. Files that changed below their checkpoint are replayed from
+# the top, except stop_events which has no natural key to dedupe on.
+CHECKPOINT_DDL = """
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+  file_name    VARCHAR(128) PRIMARY KEY,
+  byte_offset  BIGINT NOT NULL,
+  row_count    BIGINT NOT NULL,
+  content_hash CHAR(64) NOT NULL,
+  updated_at   TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+def get_checkpoint(conn, name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT byte_offset, row_count, content_hash FROM load_checkpoints WHERE file_name = %s", (name,))
+        return cur.fetchone()
+
+def save_checkpoint(conn, name, offset, rows, digest):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO load_checkpoints(file_name, byte_offset, row_count, content_hash)
+            VALUES (%s,%s,%s,%s)
+            ON CONFLICT (file_name) DO UPDATE
+            SET byte_offset = EXCLUDED.byte_offset, row_count = EXCLUDED.row_count,
+                content_hash = EXCLUDED.content_hash, updated_at = now()
+        """, (name, offset, rows, digest))
+
+def hash_prefix(f, length, block=1 << 20):
+    h = hashlib.sha256()
+    f.seek(0)
+    left = length
+    while left > 0:
+        data = f.read(min(block, left))
+        if not data:
+            break
+        h.update(data)
+        left -= len(data)
+    return h
+
+def load_incremental(conn, table, path, batch_rows=50000, refresh=False):
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    ck = get_checkpoint(conn, name)
+    loaded = 0
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offset, rows, h = len(header), 0, hash_prefix(f, len(header))
+        if ck:
+            ck_offset, ck_rows, ck_hash = ck
+            prefix = hash_prefix(f, ck_offset) if ck_offset <= size else None
+            if prefix is not None and prefix.hexdigest() == ck_hash:
+                offset, rows, h = ck_offset, ck_rows, prefix
+            elif table == 'stop_events':
+                raise ValueError(f"{name} changed below its checkpoint (byte {ck_offset}); "
+                                 "stop_events has no natural key, reload it into a fresh database")
+            else:
+                print(f"  {name}: changed since last load, replaying from the top")
+        if offset >= size:
+            print(f"  {name}: unchanged ({rows} rows checkpointed), skipped")
+            return 0
+        f.seek(offset)
+        while True:
+            batch = []
+            for line in f:
+                if not line.endswith(b'\n'):
+                    print(f"  {name}: {len(line)} trailing bytes without a newline left for the next run")
+                    break
+                batch.append(line)
+                if len(batch) >= batch_rows:
+                    break
+            if not batch:
+                break
+            data = b''.join(batch)
+            loaded += copy_load(conn, table, io.StringIO((header + data).decode('utf-8'), newline=''))
+            if refresh and table == 'stop_events':
+                refresh_aggregates(conn)
+            h.update(data)
+            offset += len(data)
+            rows += len(batch)
+            save_checkpoint(conn, name, offset, rows, h.hexdigest())
+            conn.commit()
+            if len(batch) < batch_rows:
+                break
+    return loaded
+
+# Aggregate layer (aggregates.sql): fold stop_events rows above the watermark into the
+# per-line/stop/trip summaries. Runs in the caller's transaction after every batch.
+AGG_REFRESH = [
+    ("agg_line_stats", "line_id", "t.line_id", "JOIN trips t ON t.trip_id = se.trip_id"),
+    ("agg_stop_stats", "stop_id", "se.stop_id", ""),
+    ("agg_trip_stats", "trip_id", "se.trip_id", ""),
+]
+
+def has_aggregates(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('agg_watermark') IS NOT NULL")
+        return cur.fetchone()[0]
+
+def refresh_aggregates(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_event_id FROM agg_watermark FOR UPDATE")
+        lo = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(MAX(stop_event_id), 0) FROM stop_events")
+        hi = cur.fetchone()[0]
+        if hi <= lo:
+            return 0
+        for table, key, expr, join in AGG_REFRESH:
+            cur.execute(f"""
+                INSERT INTO {table} AS a ({key}, boardings, alightings, event_count, late_count)
+                SELECT {expr}, SUM(se.passengers_on), SUM(se.passengers_off), COUNT(*),
+                       COUNT(*) FILTER (WHERE se.actual > se.scheduled + INTERVAL '2 minutes')
+                FROM stop_events se {join}
+                WHERE se.stop_event_id > %s AND se.stop_event_id <= %s
+                GROUP BY {expr}
+                ON CONFLICT ({key}) DO UPDATE SET
+                  boardings = a.boardings + EXCLUDED.boardings,
+                  alightings = a.alightings + EXCLUDED.alightings,
+                  event_count = a.event_count + EXCLUDED.event_count,
+                  late_count = a.late_count + EXCLUDED.late_count
+            """, (lo, hi))
+        cur.execute("UPDATE agg_watermark SET last_event_id = %s", (hi,))
+        return hi - lo
+
+def timed(label, fn, *args):
+    t0 = time.time()
+    n = fn(*args)
+    dt = time.time() - t0
+    rate = n / dt if dt > 0 else 0.0
+    print(f"  {label}: {n} rows in {dt:.3f}s ({rate:,.0f} rows/s)")
+    return n
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument('--host', required=True)
@@ -109,24 +486,68 @@ def main():
     ap.add_argument('--password', required=True)
     ap.add_argument('--port', default=5432, type=int)
     ap.add_argument('--datadir', required=True, help='Path to folder with CSVs (lines.csv, stops.csv, line_stops.csv, trips.csv, stop_events.csv)')
+    ap.add_argument('--schema', default='schema.sql',
+                    help='Schema profile to apply first (schema.sql, or schema_prod.sql for partitioned stop_events)')
+    ap.add_argument('--mode', choices=['row', 'copy'], default='row',
+                    help='row: one INSERT per CSV row; copy: COPY into staging tables + set-based INSERT ... SELECT')
+    ap.add_argument('--workers', type=int, default=1,
+                    help='Load stop_events.csv with N worker processes (byte-range chunks, staged then swapped in)')
+    ap.add_argument('--chunk-mb', type=int, default=64, help='Upper bound on the size of one --workers chunk')
+    ap.add_argument('--incremental', action='store_true',
+                    help='Load only rows appended since the last checkpoint; commits per batch and resumes after a crash')
+    ap.add_argument('--batch-rows', type=int, default=50000, help='Rows per committed batch with --incremental')
+    ap.add_argument('--aggregates', action='store_true',
+                    help='Create the aggregate layer (aggregates.sql); it is refreshed after every load once present')
     args = ap.parse_args()
 
     print(f"Connected target: {args.dbname}@{args.host}:{args.port}")
     conn = connect(args)
     try:
-        with open('schema.sql','r', encoding='utf-8') as f:
-            print("Creating schema...")
+        with open(args.schema,'r', encoding='utf-8') as f:
+            print(f"Creating schema ({args.schema})...")
             run_sql(conn, f.read())
+        if args.aggregates:
+            with open('aggregates.sql','r', encoding='utf-8') as f:
+                print("Creating aggregate layer...")
+                run_sql(conn, f.read())
+        refresh = has_aggregates(conn)
+
+        if args.incremental and args.workers > 1:
+            raise ValueError("--incremental and --workers cannot be combined")
+        path = lambda name: os.path.join(args.datadir, name)
+        if args.incremental:
+            print("Loading data (incremental)...")
+            run_sql(conn, CHECKPOINT_DDL)
+            conn.commit()
+            n_lines, n_stops, n_line_stops, n_trips, n_events = (
+                timed(table, load_incremental, conn, table, path(f"{table}.csv"), args.batch_rows, refresh)
+                for table in ('lines', 'stops', 'line_stops', 'trips', 'stop_events'))
+        else:
+            print(f"Loading data (mode={args.mode})...")
+            if args.mode == 'copy':
+                n_lines = timed('lines', copy_file, conn, 'lines', path('lines.csv'))
+                n_stops = timed('stops', copy_file, conn, 'stops', path('stops.csv'))
+                n_line_stops = timed('line_stops', copy_file, conn, 'line_stops', path('line_stops.csv'))
+                n_trips = timed('trips', copy_file, conn, 'trips', path('trips.csv'))
+            else:
+                n_lines = timed('lines', load_lines, conn, path('lines.csv'))
+                n_stops = timed('stops', load_stops, conn, path('stops.csv'))
+                line_map = fetch_map(conn, 'lines', 'line_name', 'line_id')
+                stop_map = fetch_map(conn, 'stops', 'stop_name', 'stop_id')
 
-        print("Loading data...")
-        n_lines = load_lines(conn, os.path.join(args.datadir, 'lines.csv'))
-        n_stops = load_stops(conn, os.path.join(args.datadir, 'stops.csv'))
-        line_map = fetch_map(conn, 'lines', 'line_name', 'line_id')
-        stop_map = fetch_map(conn, 'stops', 'stop_name', 'stop_id')
+                n_line_stops = timed('line_stops', load_line_stops, conn, path('line_stops.csv'), line_map, stop_map)
+                n_trips = timed('trips', load_trips, conn, path('trips.csv'), line_map)
 
-        n_line_stops = load_line_stops(conn, os.path.join(args.datadir, 'line_stops.csv'), line_map, stop_map)
-        n_trips = load_trips(conn, os.path.join(args.datadir, 'trips.csv'), line_map)
-        n_events = load_stop_events(conn, os.path.join(args.datadir, 'stop_events.csv'), stop_map)
+            if args.workers > 1:
+                stop_map = fetch_map(conn, 'stops', 'stop_name', 'stop_id')
+                n_events = timed('stop_events', load_stop_events_parallel, conn, conn_params(args),
+                                 path('stop_events.csv'), stop_map, args.workers, args.chunk_mb)
+            elif args.mode == 'copy':
+                n_events = timed('stop_events', copy_file, conn, 'stop_events', path('stop_events.csv'))
+            else:
+                n_events = timed('stop_events', load_stop_events, conn, path('stop_events.csv'), stop_map)
+        if refresh:
+            timed('aggregates', refresh_aggregates, conn)
 
         conn.commit()
         total = n_lines + n_stops + n_line_stops + n_trips + n_events
@@ -1,21 +1,72 @@
 #!/usr/bin/env python3
 # problem1/queries.py
 # Pretty-prints JSON by default (indent=2). Use --compact to output a single line.
-import argparse, json, os, sys, time
+# Each qN() returns (sql, params); run() executes it and stream() pipes it through a
+# server-side cursor (--stream ndjson|array) so memory stays flat on large results.
+import argparse, itertools, json, os, re, sys, time
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from spatial import EARTH_RADIUS_M, INDEX_QUERIES, StopIndex, bbox, nearest_params, point_params, radius_param
+
+def conn_params(dbname):
+    return dict(host=os.getenv('PGHOST','localhost'),
+                dbname=dbname,
+                user=os.getenv('PGUSER','postgres'),
+                password=os.getenv('PGPASSWORD','postgres'),
+                port=int(os.getenv('PGPORT','5432')))
 
 def connect(dbname):
-    return psycopg2.connect(host=os.getenv('PGHOST','localhost'),
-                            dbname=dbname,
-                            user=os.getenv('PGUSER','postgres'),
-                            password=os.getenv('PGPASSWORD','postgres'),
-                            port=int(os.getenv('PGPORT','5432')))
+    return psycopg2.connect(**conn_params(dbname))
 
 def rows(cur):
     cols=[d.name for d in cur.description]
     return [dict(zip(cols, r)) for r in cur.fetchall()]
 
-def q1(conn):
+def query_sql(conn, key):
+    """(sql, params) for key, taken from the aggregate layer when it exists (AGGREGATES=off disables)."""
+    if key in AGGREGATE_QUERIES and uses_aggregates(conn):
+        return AGGREGATE_QUERIES[key]()
+    return QUERIES[key][0]()
+
+_agg_present = {}
+
+def uses_aggregates(conn):
+    if os.getenv('AGGREGATES', 'auto') == 'off':
+        return False
+    if conn.dsn not in _agg_present:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('agg_watermark') IS NOT NULL")
+            _agg_present[conn.dsn] = cur.fetchone()[0]
+        conn.rollback()
+    return _agg_present[conn.dsn]
+
+def run(conn, key, prepared=False):
+    sql, params = query_sql(conn, key)
+    with conn.cursor() as cur:
+        if prepared:
+            cur.execute(execute_sql(key.lower(), params), params)
+        else:
+            cur.execute(sql, params)
+        return rows(cur)
+
+def prepared_statements(conn):
+    stmts = [(key.lower(), query_sql(conn, key)[0]) for key in QUERIES]
+    stmts.append(("q4_batch", q4_batch([])[0]))
+    return stmts
+
+def prepare(conn):
+    """PREPARE every registry query (plus q4_batch) once for the lifetime of this session."""
+    with conn.cursor() as cur:
+        for name, sql in prepared_statements(conn):
+            n = itertools.count(1)
+            cur.execute(f"PREPARE {name} AS {re.sub('%s', lambda m: f'${next(n)}', sql)}")
+    conn.commit()
+
+def execute_sql(name, params):
+    return f"EXECUTE {name}({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+
+def q1():
     sql = """
     SELECT s.stop_name, ls.sequence, ls.time_offset_minutes AS time_offset
     FROM line_stops ls
@@ -24,22 +75,19 @@ def q1(conn):
     WHERE l.line_name = 'Route 20'
     ORDER BY ls.sequence
     """
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        return rows(cur)
+    return sql, None
 
-def q2(conn):
+def q2():
     sql = """
     SELECT t.trip_id, l.line_name, t.scheduled_departure
     FROM trips t
     JOIN lines l ON l.line_id = t.line_id
     WHERE (t.scheduled_departure::time) >= TIME '07:00' AND (t.scheduled_departure::time) < TIME '09:00'
-    ORDER BY t.scheduled_departure
+    ORDER BY t.scheduled_departure, t.trip_id
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q3(conn):
+def q3():
     sql = """
     SELECT s.stop_name, COUNT(DISTINCT l.line_id) AS line_count
     FROM line_stops ls
@@ -49,11 +97,10 @@ def q3(conn):
     HAVING COUNT(DISTINCT l.line_id) >= 2
     ORDER BY line_count DESC, s.stop_name
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q4(conn):
-    trip = os.getenv('TRIP_ID','T0001')
+def q4(trip=None):
+    trip = trip or os.getenv('TRIP_ID','T0001')
     sql = """
     SELECT se.trip_id, s.stop_name, se.scheduled, se.actual
     FROM stop_events se
@@ -61,10 +108,19 @@ def q4(conn):
     WHERE se.trip_id = %s
     ORDER BY se.scheduled
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (trip,)); return rows(cur)
+    return sql, (trip,)
 
-def q5(conn):
+def q4_batch(trip_ids):
+    sql = """
+    SELECT se.trip_id, s.stop_name, se.scheduled, se.actual
+    FROM stop_events se
+    JOIN stops s ON s.stop_id = se.stop_id
+    WHERE se.trip_id = ANY(%s)
+    ORDER BY se.trip_id, se.scheduled
+    """
+    return sql, (list(trip_ids),)
+
+def q5():
     sql = """
     SELECT DISTINCT l.line_name
     FROM lines l
@@ -78,22 +134,20 @@ def q5(conn):
     )
     ORDER BY l.line_name
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q6(conn):
+def q6():
     sql = """
     SELECT l.line_name, ROUND(AVG(se.passengers_on)::numeric, 2) AS avg_passengers
     FROM stop_events se
     JOIN trips t ON t.trip_id = se.trip_id
     JOIN lines l ON l.line_id = t.line_id
     GROUP BY l.line_name
-    ORDER BY avg_passengers DESC
+    ORDER BY avg_passengers DESC, l.line_name
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q7(conn):
+def q7():
     sql = """
     SELECT s.stop_name,
            SUM(se.passengers_on + se.passengers_off) AS total_activity
@@ -103,10 +157,9 @@ def q7(conn):
     ORDER BY total_activity DESC, s.stop_name
     LIMIT 10
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q8(conn):
+def q8():
     sql = """
     SELECT l.line_name, COUNT(*) AS delay_count
     FROM stop_events se
@@ -114,12 +167,11 @@ def q8(conn):
     JOIN lines l ON l.line_id = t.line_id
     WHERE se.actual > se.scheduled + INTERVAL '2 minutes'
     GROUP BY l.line_name
-    ORDER BY delay_count DESC
+    ORDER BY delay_count DESC, l.line_name
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q9(conn):
+def q9():
     sql = """
     SELECT se.trip_id, COUNT(*) AS delayed_stop_count
     FROM stop_events se
@@ -128,10 +180,9 @@ def q9(conn):
     HAVING COUNT(*) >= 3
     ORDER BY delayed_stop_count DESC, se.trip_id
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
 
-def q10(conn):
+def q10():
     sql = """
     WITH totals AS (
       SELECT s.stop_name, SUM(se.passengers_on) AS total_boardings
@@ -144,10 +195,52 @@ def q10(conn):
     SELECT t.stop_name, t.total_boardings
     FROM totals t, avgv a
     WHERE t.total_boardings > a.avg_board
-    ORDER BY t.total_boardings DESC
+    ORDER BY t.total_boardings DESC, t.stop_name
     """
-    with conn.cursor() as cur:
-        cur.execute(sql); return rows(cur)
+    return sql, None
+
+# haversine distance in meters from the point (%s lat, %s lat, %s lon) to s
+HAVERSINE_SQL = f"""2 * {EARTH_RADIUS_M} * asin(least(1, sqrt(
+      power(sin(radians(s.latitude - %s) / 2), 2)
+      + cos(radians(%s)) * cos(radians(s.latitude)) * power(sin(radians(s.longitude - %s) / 2), 2))))"""
+
+def q11(lat=None, lon=None, n=None, max_radius_m=None):
+    # the bounding box of max_radius_m lets idx_stops_lat_lon prefilter before any trig
+    if lat is None or lon is None:
+        lat, lon = point_params()
+    default_n, default_max = nearest_params()
+    n = default_n if n is None else n
+    max_radius_m = default_max if max_radius_m is None else max_radius_m
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox(lat, lon, max_radius_m)
+    sql = f"""
+    SELECT d.stop_name, d.latitude, d.longitude, ROUND(d.meters::numeric, 1) AS distance_m
+    FROM (
+      SELECT s.stop_name, s.latitude, s.longitude, {HAVERSINE_SQL} AS meters
+      FROM stops s
+      WHERE s.latitude BETWEEN %s AND %s AND s.longitude BETWEEN %s AND %s
+    ) d
+    WHERE d.meters <= %s
+    ORDER BY d.meters, d.stop_name
+    LIMIT %s
+    """
+    return sql, (lat, lat, lon, lat_lo, lat_hi, lon_lo, lon_hi, max_radius_m, n)
+
+def q12(lat=None, lon=None, radius_m=None):
+    if lat is None or lon is None:
+        lat, lon = point_params()
+    radius_m = radius_param() if radius_m is None else radius_m
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox(lat, lon, radius_m)
+    sql = f"""
+    SELECT d.stop_name, d.latitude, d.longitude, ROUND(d.meters::numeric, 1) AS distance_m
+    FROM (
+      SELECT s.stop_name, s.latitude, s.longitude, {HAVERSINE_SQL} AS meters
+      FROM stops s
+      WHERE s.latitude BETWEEN %s AND %s AND s.longitude BETWEEN %s AND %s
+    ) d
+    WHERE d.meters <= %s
+    ORDER BY d.meters, d.stop_name
+    """
+    return sql, (lat, lat, lon, lat_lo, lat_hi, lon_lo, lon_hi, radius_m)
 
 QUERIES = {
     "Q1": (q1, "List all stops on Route 20 in order"),
@@ -160,44 +253,266 @@ QUERIES = {
     "Q8": (q8, "Count delays by line (> 2 min)"),
     "Q9": (q9, "Trips with 3+ delayed stops"),
     "Q10": (q10, "Stops with above-average ridership (boardings)"),
+    "Q11": (q11, "Nearest N stops to a point"),
+    "Q12": (q12, "Stops within a radius of a point"),
 }
 
+# Q6-Q10 over the summary tables of aggregates.sql; same columns and ordering as above.
+def q6_agg():
+    sql = """
+    SELECT l.line_name, ROUND(a.boardings::numeric / a.event_count, 2) AS avg_passengers
+    FROM agg_line_stats a
+    JOIN lines l ON l.line_id = a.line_id
+    WHERE a.event_count > 0
+    ORDER BY avg_passengers DESC, l.line_name
+    """
+    return sql, None
+
+def q7_agg():
+    sql = """
+    SELECT s.stop_name, a.boardings + a.alightings AS total_activity
+    FROM agg_stop_stats a
+    JOIN stops s ON s.stop_id = a.stop_id
+    WHERE a.event_count > 0
+    ORDER BY total_activity DESC, s.stop_name
+    LIMIT 10
+    """
+    return sql, None
+
+def q8_agg():
+    sql = """
+    SELECT l.line_name, a.late_count AS delay_count
+    FROM agg_line_stats a
+    JOIN lines l ON l.line_id = a.line_id
+    WHERE a.late_count > 0
+    ORDER BY delay_count DESC, l.line_name
+    """
+    return sql, None
+
+def q9_agg():
+    sql = """
+    SELECT a.trip_id, a.late_count AS delayed_stop_count
+    FROM agg_trip_stats a
+    WHERE a.late_count >= 3
+    ORDER BY delayed_stop_count DESC, a.trip_id
+    """
+    return sql, None
+
+def q10_agg():
+    sql = """
+    WITH totals AS (
+      SELECT s.stop_name, a.boardings AS total_boardings
+      FROM agg_stop_stats a
+      JOIN stops s ON s.stop_id = a.stop_id
+      WHERE a.event_count > 0
+    ), avgv AS (
+      SELECT AVG(total_boardings) AS avg_board FROM totals
+    )
+    SELECT t.stop_name, t.total_boardings
+    FROM totals t, avgv a
+    WHERE t.total_boardings > a.avg_board
+    ORDER BY t.total_boardings DESC, t.stop_name
+    """
+    return sql, None
+
+AGGREGATE_QUERIES = {"Q6": q6_agg, "Q7": q7_agg, "Q8": q8_agg, "Q9": q9_agg, "Q10": q10_agg}
+
 def emit(obj, compact=False):
     if compact:
         print(json.dumps(obj, default=str))
     else:
         print(json.dumps(obj, default=str, indent=2, ensure_ascii=False))
 
+def result(conn, key, prepared=False):
+    desc = QUERIES[key][1]
+    t0=time.time()
+    data = run(conn, key, prepared)
+    return {
+        "query": key, "description": desc, "results": data, "count": len(data),
+        "execution_time_ms": round((time.time()-t0)*1000,2)
+    }
+
+def index_result(index, key):
+    """result() for Q11/Q12 answered by a spatial.StopIndex instead of the engine."""
+    t0=time.time()
+    data = INDEX_QUERIES[key](index)
+    return {
+        "query": key, "description": QUERIES[key][1], "results": data, "count": len(data),
+        "execution_time_ms": round((time.time()-t0)*1000,2)
+    }
+
+def results_parallel(dbname, keys, workers, prepared=False):
+    """Run independent queries concurrently on pooled connections; yields results in key order."""
+    # minconn == maxconn: the pool closes connections returned above minconn, which would
+    # also throw away their prepared statements
+    pool = ThreadedConnectionPool(workers, workers, **conn_params(dbname))
+    ready = set()
+
+    def task(key):
+        conn = pool.getconn()
+        try:
+            if prepared and conn not in ready:
+                prepare(conn)
+                ready.add(conn)
+            return result(conn, key, prepared)
+        finally:
+            pool.putconn(conn)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            yield from ex.map(task, keys)
+    finally:
+        pool.closeall()
+
+def compare_q4(conn, n_trips):
+    """Time Q4 for n_trips trips as raw SQL text, as EXECUTE of a prepared plan, and as one ANY() batch."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT trip_id FROM trips ORDER BY trip_id LIMIT %s", (n_trips,))
+        trips = [r[0] for r in cur.fetchall()]
+    prepare(conn)
+    timings = {}
+    with conn.cursor() as cur:
+        t0 = time.time()
+        for trip in trips:
+            cur.execute(*q4(trip)); cur.fetchall()
+        timings["text"] = time.time() - t0
+        t0 = time.time()
+        for trip in trips:
+            cur.execute(execute_sql("q4", (trip,)), (trip,)); cur.fetchall()
+        timings["prepared"] = time.time() - t0
+        t0 = time.time()
+        sql, params = q4_batch(trips)
+        cur.execute(execute_sql("q4_batch", params), params)
+        n_rows = len(cur.fetchall())
+        timings["batched"] = time.time() - t0
+    conn.commit()
+    return {
+        "query": "Q4", "trips": len(trips), "rows": n_rows,
+        "total_ms": {k: round(v*1000,2) for k, v in timings.items()},
+        "per_trip_ms": {k: round(v*1000/max(len(trips),1),4) for k, v in timings.items()},
+    }
+
+def stream(conn, key, fmt='ndjson', itersize=2000, out=sys.stdout):
+    """Write rows as they arrive from a named cursor; nothing is held beyond one itersize batch.
+
+    ndjson: a {"query", "description"} header line, one line per row, then a summary line.
+    array:  the same object shape as emit(), written incrementally one row per line.
+    """
+    desc = QUERIES[key][1]
+    sql, params = query_sql(conn, key)
+    head = json.dumps({"query": key, "description": desc}, ensure_ascii=False)
+    out.write(head + "\n" if fmt == 'ndjson' else head[:-1] + ', "results": [')
+    t0 = time.time()
+    first = None
+    count = 0
+    with conn.cursor(name=f"stream_{key.lower()}") as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        cols = None
+        for r in cur:
+            if cols is None:
+                first = time.time()
+                cols = [d.name for d in cur.description]
+            line = json.dumps(dict(zip(cols, r)), default=str, ensure_ascii=False)
+            if fmt == 'ndjson':
+                out.write(line + "\n")
+            else:
+                out.write(("," if count else "") + "\n  " + line)
+            count += 1
+            if count % itersize == 0:
+                out.flush()
+    conn.commit()
+    elapsed = round((time.time()-t0)*1000,2)
+    ttfr = round((first-t0)*1000,2) if first else None
+    if fmt == 'ndjson':
+        out.write(json.dumps({"query": key, "count": count, "execution_time_ms": elapsed,
+                              "time_to_first_row_ms": ttfr}) + "\n")
+    else:
+        out.write(f'\n], "count": {count}, "execution_time_ms": {elapsed}, "time_to_first_row_ms": {json.dumps(ttfr)}}}\n')
+    out.flush()
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument('--query', choices=QUERIES.keys())
     ap.add_argument('--all', action='store_true')
-    ap.add_argument('--dbname', required=True)
+    ap.add_argument('--dbname')
+    ap.add_argument('--engine', choices=['postgres', 'columnar'], default='postgres',
+                    help='columnar: answer the queries in-process from the CSVs with NumPy (no database)')
+    ap.add_argument('--datadir', default='data', help='CSV directory for --engine columnar')
+    ap.add_argument('--cache-dir', help='Column cache for --engine columnar (default <datadir>/.columnar)')
+    ap.add_argument('--no-cache', action='store_true', help='--engine columnar: rebuild from the CSVs, write no cache')
     # Output control: pretty by default; use --compact to disable indentation
     ap.add_argument('--compact', action='store_true', help='Emit compact single-line JSON')
+    ap.add_argument('--stream', choices=['ndjson', 'array'],
+                    help='Stream rows through a server-side cursor instead of buffering the result')
+    ap.add_argument('--itersize', type=int, default=2000, help='Rows per server-side cursor fetch with --stream')
+    ap.add_argument('--parallel', type=int, default=1,
+                    help='Run the selected queries concurrently over a pool of N connections')
+    ap.add_argument('--prepared', action='store_true',
+                    help='PREPARE every query once per connection and run it with EXECUTE')
+    ap.add_argument('--compare-q4', type=int, metavar='N',
+                    help='Time Q4 for N trips: raw text vs prepared vs one batched ANY() call')
+    ap.add_argument('--spatial', choices=['engine', 'kdtree'], default='engine',
+                    help="Q11/Q12 backend: the engine's bounding box + haversine, or a KD-tree (spatial.StopIndex) built once per run")
     args = ap.parse_args()
+    keys = list(QUERIES) if args.all else [args.query]
+    use_index = args.spatial == 'kdtree' and any(k in INDEX_QUERIES for k in keys)
+    if args.engine == 'columnar':
+        if args.stream or args.parallel > 1 or args.prepared or args.compare_q4:
+            ap.error("--engine columnar supports --query/--all and --compact only")
+        if not args.all and not args.query:
+            ap.error("one of --query or --all is required")
+        import columnar
+        db = columnar.load(args.datadir, args.cache_dir, use_cache=not args.no_cache)
+        index = columnar.stop_index(db) if use_index else None
+        for key in keys:
+            if index is not None and key in INDEX_QUERIES:
+                emit(index_result(index, key), compact=args.compact)
+            else:
+                emit(columnar.result(db, key, QUERIES[key][1]), compact=args.compact)
+        return
+    if not args.dbname:
+        ap.error("--dbname is required")
+    if args.compare_q4:
+        conn = connect(args.dbname)
+        try:
+            emit(compare_q4(conn, args.compare_q4), compact=args.compact)
+        finally:
+            conn.close()
+        return
+    if not args.all and not args.query:
+        ap.error("one of --query or --all is required")
+    if args.parallel > 1 and args.stream:
+        ap.error("--parallel cannot be combined with --stream")
+    if args.prepared and args.stream:
+        # the named cursor is a DECLARE ... CURSOR FOR <query>, which cannot wrap an EXECUTE
+        ap.error("--prepared cannot be combined with --stream")
+    if use_index and (args.stream or args.parallel > 1):
+        ap.error("--spatial kdtree cannot be combined with --stream or --parallel")
+
+    if args.parallel > 1:
+        t0 = time.time()
+        total = 0.0
+        for out in results_parallel(args.dbname, keys, args.parallel, args.prepared):
+            total += out["execution_time_ms"]
+            emit(out, compact=args.compact)
+        emit({"parallel": args.parallel, "queries": len(keys),
+              "wall_time_ms": round((time.time()-t0)*1000,2),
+              "sum_execution_time_ms": round(total,2)}, compact=args.compact)
+        return
 
     conn = connect(args.dbname)
     try:
-        if args.all:
-            for key in QUERIES:
-                func, desc = QUERIES[key]
-                t0=time.time()
-                data = func(conn)
-                out = {
-                    "query": key, "description": desc, "results": data, "count": len(data),
-                    "execution_time_ms": round((time.time()-t0)*1000,2)
-                }
-                emit(out, compact=args.compact)
-        else:
-            func, desc = QUERIES[args.query]
-            t0=time.time()
-            data = func(conn)
-            out = {
-                "query": args.query, "description": desc, "results": data, "count": len(data),
-                "execution_time_ms": round((time.time()-t0)*1000,2)
-            }
-            emit(out, compact=args.compact)
+        if args.prepared:
+            prepare(conn)
+        index = StopIndex.from_db(conn) if use_index else None
+        for key in keys:
+            if index is not None and key in INDEX_QUERIES:
+                emit(index_result(index, key), compact=args.compact)
+            elif args.stream:
+                stream(conn, key, args.stream, args.itersize)
+            else:
+                emit(result(conn, key, args.prepared), compact=args.compact)
     finally:
         conn.close()
 
@@ -36,3 +36,5 @@ CREATE TABLE IF NOT EXISTS stop_events (
 CREATE INDEX IF NOT EXISTS idx_trips_line ON trips(line_id);
 CREATE INDEX IF NOT EXISTS idx_events_trip ON stop_events(trip_id);
 CREATE INDEX IF NOT EXISTS idx_events_stop ON stop_events(stop_id);
+-- Q11/Q12: bounding-box prefilter on the stop coordinates
+CREATE INDEX IF NOT EXISTS idx_stops_lat_lon ON stops(latitude, longitude) INCLUDE (stop_name);
@@ -0,0 +1,96 @@
+-- problem1/schema_prod.sql
+-- Production profile (load_data.py --schema schema_prod.sql): same tables and columns as
+-- schema.sql, with stop_events range-partitioned by month on scheduled, a stored
+-- delay_seconds column and indexes shaped after the Q2/Q4/Q7/Q8/Q9 access paths.
+CREATE TABLE IF NOT EXISTS lines (
+  line_id      SERIAL PRIMARY KEY,
+  line_name    VARCHAR(64) NOT NULL UNIQUE,
+  vehicle_type VARCHAR(16) NOT NULL CHECK (vehicle_type IN ('rail','bus'))
+);
+CREATE TABLE IF NOT EXISTS stops (
+  stop_id   SERIAL PRIMARY KEY,
+  stop_name VARCHAR(128) NOT NULL UNIQUE,
+  latitude  DOUBLE PRECISION,
+  longitude DOUBLE PRECISION
+);
+CREATE TABLE IF NOT EXISTS line_stops (
+  line_stop_id SERIAL PRIMARY KEY,
+  line_id      INTEGER NOT NULL REFERENCES lines(line_id) ON DELETE CASCADE,
+  stop_id      INTEGER NOT NULL REFERENCES stops(stop_id) ON DELETE CASCADE,
+  sequence     INTEGER NOT NULL CHECK (sequence > 0),
+  time_offset_minutes INTEGER NOT NULL CHECK (time_offset_minutes >= 0),
+  UNIQUE (line_id, sequence)
+);
+CREATE TABLE IF NOT EXISTS trips (
+  trip_id             VARCHAR(32) PRIMARY KEY,
+  line_id             INTEGER NOT NULL REFERENCES lines(line_id) ON DELETE RESTRICT,
+  scheduled_departure TIMESTAMP NOT NULL,
+  vehicle_id          VARCHAR(32) NOT NULL
+);
+-- the partition key has to be part of the primary key
+CREATE TABLE IF NOT EXISTS stop_events (
+  stop_event_id SERIAL,
+  trip_id       VARCHAR(32) NOT NULL REFERENCES trips(trip_id) ON DELETE CASCADE,
+  stop_id       INTEGER NOT NULL REFERENCES stops(stop_id) ON DELETE RESTRICT,
+  scheduled     TIMESTAMP NOT NULL,
+  actual        TIMESTAMP NOT NULL,
+  passengers_on  INTEGER NOT NULL CHECK (passengers_on  >= 0),
+  passengers_off INTEGER NOT NULL CHECK (passengers_off >= 0),
+  delay_seconds  INTEGER GENERATED ALWAYS AS (EXTRACT(EPOCH FROM (actual - scheduled))::integer) STORED,
+  PRIMARY KEY (stop_event_id, scheduled)
+) PARTITION BY RANGE (scheduled);
+CREATE TABLE IF NOT EXISTS stop_events_default PARTITION OF stop_events DEFAULT;
+
+-- Monthly partitions covering [lo, hi]. Every load path calls this with the range of the rows
+-- it is about to insert, so only months that hold data exist (empty partitions still cost
+-- planning and an Append branch for queries that cannot prune, like Q4). A new month cannot
+-- be attached while the default partition holds rows of it, so in that case the default is
+-- detached, its rows in [lo's month, hi's month] are moved into the new partitions and it
+-- is attached again.
+CREATE OR REPLACE FUNCTION ensure_stop_event_partitions(lo TIMESTAMP, hi TIMESTAMP) RETURNS void AS $$
+DECLARE
+  first DATE := date_trunc('month', lo)::date;
+  m DATE := first;
+  part TEXT;
+  detached BOOLEAN := false;
+BEGIN
+  WHILE m <= hi LOOP
+    part := format('stop_events_%s', to_char(m, 'YYYY_MM'));
+    IF to_regclass(part) IS NULL THEN
+      IF NOT detached AND EXISTS (SELECT 1 FROM stop_events_default
+                                  WHERE scheduled >= m AND scheduled < m + INTERVAL '1 month') THEN
+        ALTER TABLE stop_events DETACH PARTITION stop_events_default;
+        detached := true;
+      END IF;
+      EXECUTE format('CREATE TABLE %I PARTITION OF stop_events FOR VALUES FROM (%L) TO (%L)',
+                     part, m, (m + INTERVAL '1 month')::date);
+    END IF;
+    m := (m + INTERVAL '1 month')::date;
+  END LOOP;
+  IF detached THEN
+    -- every month in [first, m) has a partition now; stop_event_id is kept for the aggregate watermark
+    WITH moved AS (
+      DELETE FROM stop_events_default WHERE scheduled >= first AND scheduled < m
+      RETURNING stop_event_id, trip_id, stop_id, scheduled, actual, passengers_on, passengers_off
+    )
+    INSERT INTO stop_events(stop_event_id, trip_id, stop_id, scheduled, actual, passengers_on, passengers_off)
+    SELECT * FROM moved;
+    ALTER TABLE stop_events ATTACH PARTITION stop_events_default DEFAULT;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_trips_line ON trips(line_id);
+-- Q2: time-of-day window on scheduled_departure, ordered by scheduled_departure
+CREATE INDEX IF NOT EXISTS idx_trips_departure_tod ON trips ((scheduled_departure::time), scheduled_departure);
+-- Q6/Q8: trip -> line join without touching the heap
+CREATE INDEX IF NOT EXISTS idx_trips_trip_line ON trips(trip_id) INCLUDE (line_id);
+-- Q4: one trip's events in schedule order, index-only
+CREATE INDEX IF NOT EXISTS idx_events_trip_sched ON stop_events(trip_id, scheduled) INCLUDE (stop_id, actual);
+-- Q7/Q10: per-stop passenger sums, index-only
+CREATE INDEX IF NOT EXISTS idx_events_stop_pax ON stop_events(stop_id) INCLUDE (passengers_on, passengers_off);
+-- Q8/Q9: delayed events only; the predicate is the one the queries use so the planner can match it
+CREATE INDEX IF NOT EXISTS idx_events_delayed ON stop_events(trip_id) INCLUDE (delay_seconds)
+  WHERE actual > scheduled + INTERVAL '2 minutes';
+-- Q11/Q12: bounding-box prefilter on the stop coordinates
+CREATE INDEX IF NOT EXISTS idx_stops_lat_lon ON stops(latitude, longitude) INCLUDE (stop_name);
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# problem1/spatial.py
+# Geo helpers shared by Q11/Q12 (queries.py, columnar.py) and StopIndex, an in-process KD-tree
+# over the stops for repeated nearest-N / within-radius lookups without a database round trip;
+# queries.py --spatial kdtree answers Q11/Q12 from one StopIndex built per run.
+# Run directly to benchmark the KD-tree (and, with --dbname, the SQL Q11/Q12) against a naive
+# haversine scan of every stop.
+import argparse, csv, heapq, json, math, os, random, time
+from decimal import Decimal, ROUND_HALF_UP
+
+EARTH_RADIUS_M = 6371008.8  # mean radius; the SQL in queries.py uses the same constant
+
+def point_params():
+    """Query point for Q11/Q12 (default: Westwood / UCLA)."""
+    return float(os.getenv('POINT_LAT', '34.0689')), float(os.getenv('POINT_LON', '-118.4452'))
+
+def nearest_params():
+    """(N, max radius in meters) for Q11; stops further away than the cap are never returned."""
+    return int(os.getenv('NEAREST_N', '5')), float(os.getenv('MAX_RADIUS_M', '5000'))
+
+def radius_param():
+    return float(os.getenv('RADIUS_M', '1000'))
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox(lat, lon, radius_m):
+    """(lat_lo, lat_hi, lon_lo, lon_hi) enclosing every point within radius_m; a prefilter
+    for the index, the haversine test still decides. Near a pole or across the antimeridian
+    the longitude range opens up to the full [-180, 180]."""
+    r = radius_m / EARTH_RADIUS_M
+    dlat = math.degrees(r)
+    lat_lo, lat_hi = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    s = math.sin(r) / max(math.cos(math.radians(lat)), 1e-12)
+    if lat_lo <= -90.0 or lat_hi >= 90.0 or s >= 1.0:
+        return lat_lo, lat_hi, -180.0, 180.0
+    dlon = math.degrees(math.asin(s))
+    if lon - dlon < -180.0 or lon + dlon > 180.0:
+        return lat_lo, lat_hi, -180.0, 180.0
+    return lat_lo, lat_hi, lon - dlon, lon + dlon
+
+def round_m(meters):
+    # ROUND(x::numeric, 1): float8 -> numeric keeps 15 significant digits, then half away from zero
+    return Decimal('%.15g' % meters).quantize(Decimal('0.1'), ROUND_HALF_UP)
+
+def unit_vector(lat, lon):
+    p, l = math.radians(lat), math.radians(lon)
+    return (math.cos(p) * math.cos(l), math.cos(p) * math.sin(l), math.sin(p))
+
+def chord2(radius_m):
+    """Squared straight-line distance between unit vectors radius_m apart on the surface."""
+    return (2 * math.sin(min(math.pi, radius_m / EARTH_RADIUS_M) / 2)) ** 2
+
+class StopIndex:
+    """KD-tree over the stops' 3-D unit vectors. Chord length orders points exactly like
+    great-circle distance and has no longitude wrap-around or pole cases. Built once; lookups
+    return the same rows, in the same order, as Q11/Q12."""
+    def __init__(self, stops):
+        self.stops = [(name, lat, lon) for name, lat, lon in stops if lat is not None and lon is not None]
+        self.xyz = [unit_vector(lat, lon) for _, lat, lon in self.stops]
+        n = len(self.stops)
+        self.point, self.axis = [0] * n, [0] * n
+        self.left, self.right = [-1] * n, [-1] * n
+        self.root = self._build(list(range(n)), [0])
+
+    def _build(self, idx, counter):
+        if not idx:
+            return -1
+        spans = [max(self.xyz[i][a] for i in idx) - min(self.xyz[i][a] for i in idx) for a in range(3)]
+        axis = spans.index(max(spans))
+        idx.sort(key=lambda i: self.xyz[i][axis])
+        mid = len(idx) // 2
+        node = counter[0]
+        counter[0] += 1
+        self.point[node], self.axis[node] = idx[mid], axis
+        self.left[node] = self._build(idx[:mid], counter)
+        self.right[node] = self._build(idx[mid + 1:], counter)
+        return node
+
+    @classmethod
+    def from_csv(cls, path):
+        """stops.csv with load_data.py's rule: the first row of a repeated stop_name wins."""
+        seen, stops = set(), []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row['stop_name'] in seen:
+                    continue
+                seen.add(row['stop_name'])
+                lat, lon = row.get('latitude', '').strip(), row.get('longitude', '').strip()
+                stops.append((row['stop_name'], float(lat) if lat else None, float(lon) if lon else None))
+        return cls(stops)
+
+    @classmethod
+    def from_db(cls, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT stop_name, latitude, longitude FROM stops")
+            stops = cur.fetchall()
+        conn.rollback()
+        return cls(stops)
+
+    def _rows(self, hits, lat, lon):
+        rows = sorted((haversine_m(lat, lon, self.stops[i][1], self.stops[i][2]), self.stops[i][0], i) for i in hits)
+        return [{"stop_name": name, "latitude": self.stops[i][1], "longitude": self.stops[i][2], "distance_m": round_m(d)}
+                for d, name, i in rows]
+
+    def within(self, lat, lon, radius_m):
+        """Q12: stops within radius_m of the point, nearest first."""
+        q, r2 = unit_vector(lat, lon), chord2(radius_m)
+        hits, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            if node < 0:
+                continue
+            p = self.xyz[self.point[node]]
+            if (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2 <= r2:
+                hits.append(self.point[node])
+            diff = q[self.axis[node]] - p[self.axis[node]]
+            stack.append(self.left[node] if diff < 0 else self.right[node])
+            if diff * diff <= r2:
+                stack.append(self.right[node] if diff < 0 else self.left[node])
+        # the haversine test is the definition; chord and haversine can disagree in the last ulp
+        return [r for r in self._rows(hits, lat, lon) if haversine_m(lat, lon, r["latitude"], r["longitude"]) <= radius_m]
+
+    def nearest(self, lat, lon, n, max_radius_m=None):
+        """Q11: the n nearest stops, none further than max_radius_m."""
+        if n <= 0:
+            return []
+        q = unit_vector(lat, lon)
+        bound = chord2(max_radius_m) if max_radius_m is not None else float('inf')
+        best = []  # max-heap of (-chord2, point) holding at most n
+
+        def visit(node):
+            if node < 0:
+                return
+            i = self.point[node]
+            p = self.xyz[i]
+            d2 = (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+            worst = -best[0][0] if len(best) == n else bound
+            if d2 <= worst:
+                if len(best) == n:
+                    heapq.heapreplace(best, (-d2, i))
+                else:
+                    heapq.heappush(best, (-d2, i))
+            diff = q[self.axis[node]] - p[self.axis[node]]
+            near, far = (self.left[node], self.right[node]) if diff < 0 else (self.right[node], self.left[node])
+            visit(near)
+            worst = -best[0][0] if len(best) == n else bound
+            if diff * diff <= worst:
+                visit(far)
+
+        visit(self.root)
+        rows = self._rows([i for _, i in best], lat, lon)
+        if max_radius_m is not None:
+            rows = [r for r in rows if haversine_m(lat, lon, r["latitude"], r["longitude"]) <= max_radius_m]
+        return rows[:n]
+
+# Q11/Q12 answered from a StopIndex with the parameters the SQL reads (queries.py --spatial kdtree)
+def q11(index):
+    lat, lon = point_params()
+    n, max_radius_m = nearest_params()
+    return index.nearest(lat, lon, n, max_radius_m)
+
+def q12(index):
+    lat, lon = point_params()
+    return index.within(lat, lon, radius_param())
+
+INDEX_QUERIES = {"Q11": q11, "Q12": q12}
+
+def scan_within(stops, lat, lon, radius_m):
+    """Naive baseline: haversine to every stop."""
+    rows = sorted((haversine_m(lat, lon, s_lat, s_lon), name, s_lat, s_lon)
+                  for name, s_lat, s_lon in stops if s_lat is not None and s_lon is not None)
+    return [{"stop_name": name, "latitude": a, "longitude": b, "distance_m": round_m(d)}
+            for d, name, a, b in rows if d <= radius_m]
+
+def scan_nearest(stops, lat, lon, n, max_radius_m=None):
+    return scan_within(stops, lat, lon, float('inf') if max_radius_m is None else max_radius_m)[:n]
+
+def percentile(sorted_vals, p):
+    k = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def timed(fn, points):
+    samples, results = [], []
+    for lat, lon in points:
+        t0 = time.perf_counter()
+        results.append(fn(lat, lon))
+        samples.append((time.perf_counter() - t0) * 1e6)
+    ordered = sorted(samples)
+    return results, {f"p{p}_us": round(percentile(ordered, p), 1) for p in (50, 95, 99)} | {
+        "mean_us": round(sum(samples) / len(samples), 1)}
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark nearest/within-radius stop lookups")
+    ap.add_argument('--datadir', default='data', help='stops.csv to index (ignored with --dbname)')
+    ap.add_argument('--dbname', help='Also time the SQL Q11/Q12 and index the stops table instead of the CSV')
+    ap.add_argument('--synthetic', type=int, default=0,
+                    help='Add N random stops inside the bounding box of the real ones (in-process backends only)')
+    ap.add_argument('--lookups', type=int, default=1000, help='Random query points per backend')
+    ap.add_argument('--n', type=int, default=5, help='N for nearest')
+    ap.add_argument('--radius', type=float, default=1000.0, help='Meters for within-radius')
+    ap.add_argument('--max-radius', type=float, default=5000.0, help='Cap for nearest, as MAX_RADIUS_M in Q11')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    conn = None
+    if args.dbname:
+        from queries import connect, q11 as sql_q11, q12 as sql_q12
+        conn = connect(args.dbname)
+        index = StopIndex.from_db(conn)
+    else:
+        index = StopIndex.from_csv(os.path.join(args.datadir, 'stops.csv'))
+    rnd = random.Random(args.seed)
+    lats = [s[1] for s in index.stops]
+    lons = [s[2] for s in index.stops]
+    box = (min(lats), max(lats), min(lons), max(lons))
+    stops = index.stops + [(f"synthetic {i}", rnd.uniform(box[0], box[1]), rnd.uniform(box[2], box[3]))
+                           for i in range(args.synthetic)]
+    t0 = time.perf_counter()
+    index = StopIndex(stops)
+    build_ms = round((time.perf_counter() - t0) * 1000, 2)
+    points = [(rnd.uniform(box[0], box[1]), rnd.uniform(box[2], box[3])) for _ in range(args.lookups)]
+
+    backends = {
+        "nearest": {
+            "kdtree": lambda lat, lon: index.nearest(lat, lon, args.n, args.max_radius),
+            "scan": lambda lat, lon: scan_nearest(stops, lat, lon, args.n, args.max_radius),
+        },
+        "within": {
+            "kdtree": lambda lat, lon: index.within(lat, lon, args.radius),
+            "scan": lambda lat, lon: scan_within(stops, lat, lon, args.radius),
+        },
+    }
+    if conn is not None and not args.synthetic:
+        def sql(q):
+            def run(lat, lon):
+                with conn.cursor() as cur:
+                    cur.execute(*q(lat, lon))
+                    cols = [d.name for d in cur.description]
+                    return [dict(zip(cols, r)) for r in cur.fetchall()]
+            return run
+        backends["nearest"]["sql"] = sql(lambda lat, lon: sql_q11(lat, lon, args.n, args.max_radius))
+        backends["within"]["sql"] = sql(lambda lat, lon: sql_q12(lat, lon, args.radius))
+
+    print(json.dumps({"stops": len(stops), "lookups": len(points), "kdtree_build_ms": build_ms}))
+    try:
+        for kind, fns in backends.items():
+            expected, _ = timed(fns["scan"], points)
+            for name, fn in fns.items():
+                results, stats = timed(fn, points)
+                print(json.dumps({"query": kind, "backend": name, **stats,
+                                  "rows": sum(map(len, results)), "matches_scan": results == expected}))
+    finally:
+        if conn is not None:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,8 @@ echo "Testing all queries..."
 for i in {1..10}; do
   docker-compose run --rm app python queries.py --query Q$i --dbname transit --format json
 done
+echo "Comparing both engines with out/..."
+docker-compose run --rm -e COMPARE_DBNAME=transit app python test_outputs.py
+echo "Testing the partitioned schema profile..."
+docker-compose run --rm app python test_prod_load.py
 docker-compose down
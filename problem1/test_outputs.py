@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# problem1/test_outputs.py
+# The reference outputs in out/Q*.json must be reproduced row for row, in order: always by
+# `queries.py --engine columnar --all`, and by the PostgreSQL engine when COMPARE_DBNAME names a
+# loaded database (connection from PGHOST/PGUSER/PGPASSWORD/PGPORT). execution_time_ms is the
+# only field not compared. Q11/Q12 are also checked across backends: the SQL (or, without a
+# database, the columnar engine) against --spatial kdtree. Run: python test_outputs.py
+import json, os, subprocess, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ('query', 'description', 'results', 'count')
+
+def references():
+    refs = {}
+    for name in sorted(os.listdir(os.path.join(HERE, 'out'))):
+        if name.startswith('Q') and name.endswith('.json') and name[1:-5].isdigit():
+            with open(os.path.join(HERE, 'out', name), encoding='utf-8-sig') as f:
+                ref = json.load(f)
+            refs[ref['query']] = ref
+    return refs
+
+def run_all(*args):
+    out = subprocess.run([sys.executable, 'queries.py', '--all', '--compact', *args], cwd=HERE, check=True,
+                         capture_output=True, text=True, env=dict(os.environ, AGGREGATES='off')).stdout
+    return {obj['query']: obj for obj in map(json.loads, out.splitlines())}
+
+def compare(got):
+    refs = references()
+    assert refs, "no out/Q*.json references"
+    for key, ref in refs.items():
+        assert key in got, f"{key} missing from the output"
+        for field in FIELDS:
+            assert got[key][field] == ref[field], f"{key}: {field} differs from out/{key}.json"
+
+def test_columnar_matches_out():
+    compare(run_all('--engine', 'columnar', '--no-cache'))
+
+def test_postgres_matches_out():
+    dbname = os.getenv('COMPARE_DBNAME')
+    if not dbname:
+        print("COMPARE_DBNAME not set, PostgreSQL engine not compared")
+        return
+    compare(run_all('--dbname', dbname))
+
+# query points/radii for Q11/Q12: the default, a wide radius, and a point with no stop in range
+SPATIAL_CASES = [
+    {},
+    {'POINT_LAT': '34.05', 'POINT_LON': '-118.25', 'NEAREST_N': '20', 'MAX_RADIUS_M': '20000', 'RADIUS_M': '8000'},
+    {'POINT_LAT': '40.0', 'POINT_LON': '-100.0', 'RADIUS_M': '1000'},
+]
+
+def spatial_results(env, *args):
+    out = {}
+    for key in ('Q11', 'Q12'):
+        text = subprocess.run([sys.executable, 'queries.py', '--query', key, '--compact', *args], cwd=HERE, check=True,
+                              capture_output=True, text=True, env=dict(os.environ, **env)).stdout
+        out[key] = json.loads(text)['results']
+    return out
+
+def test_spatial_backends_agree():
+    """--spatial kdtree (one StopIndex per run) returns the rows of the engines' own Q11/Q12."""
+    dbname = os.getenv('COMPARE_DBNAME')
+    for env in SPATIAL_CASES:
+        expected = spatial_results(env, '--dbname', dbname) if dbname else spatial_results(env, '--engine', 'columnar')
+        if 'NEAREST_N' in env:
+            assert len(expected['Q11']) == int(env['NEAREST_N']), f"expected a full Q11 page for {env}"
+        backends = [('columnar', '--engine', 'columnar'), ('columnar kdtree', '--engine', 'columnar', '--spatial', 'kdtree')]
+        if dbname:
+            backends.append(('postgres kdtree', '--dbname', dbname, '--spatial', 'kdtree'))
+        for name, *args in backends:
+            assert spatial_results(env, *args) == expected, f"{name} Q11/Q12 differ for {env}"
+
+if __name__ == '__main__':
+    test_columnar_matches_out()
+    test_postgres_matches_out()
+    test_spatial_backends_agree()
+    print("outputs match out/")
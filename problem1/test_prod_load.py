@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# problem1/test_prod_load.py
+# schema_prod.sql regression: a per-row load followed by a COPY load must keep stop_events out
+# of the default partition, and a database whose default partition already holds rows of a
+# month must still accept that month's partition. Uses PGHOST/PGUSER/PGPASSWORD/PGPORT and
+# a scratch database (TEST_DBNAME, dropped and recreated by each test). Run: python test_prod_load.py
+import os, subprocess, sys
+import psycopg2
+
+DBNAME = os.getenv('TEST_DBNAME', 'transit_prod_test')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def params(dbname):
+    return dict(host=os.getenv('PGHOST', 'localhost'), user=os.getenv('PGUSER', 'transit'),
+                password=os.getenv('PGPASSWORD', ''), port=int(os.getenv('PGPORT', '5432')), dbname=dbname)
+
+def recreate():
+    conn = psycopg2.connect(**params('postgres'))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{DBNAME}"')
+        cur.execute(f'CREATE DATABASE "{DBNAME}"')
+    conn.close()
+
+def load(mode):
+    p = params(DBNAME)
+    subprocess.run([sys.executable, 'load_data.py', '--host', p['host'], '--dbname', DBNAME, '--user', p['user'],
+                    '--password', p['password'], '--port', str(p['port']), '--datadir', 'data',
+                    '--schema', 'schema_prod.sql', '--mode', mode], cwd=HERE, check=True)
+
+def scalar(cur, sql, args=None):
+    cur.execute(sql, args)
+    return cur.fetchone()[0]
+
+def test_row_then_copy_load():
+    recreate()
+    load('row')
+    load('copy')
+    with psycopg2.connect(**params(DBNAME)) as conn, conn.cursor() as cur:
+        events = scalar(cur, "SELECT COUNT(*) FROM stop_events")
+        # stop_events has no natural key, so the second load appends a second copy
+        assert events == 2 * 11025, events
+        assert scalar(cur, "SELECT COUNT(*) FROM stop_events_default") == 0
+        assert scalar(cur, "SELECT COUNT(*) FROM stop_events_2025_10") == events
+
+def test_default_rows_move_to_new_partition():
+    recreate()
+    load('copy')
+    with psycopg2.connect(**params(DBNAME)) as conn, conn.cursor() as cur:
+        trip = scalar(cur, "SELECT trip_id FROM trips LIMIT 1")
+        stop = scalar(cur, "SELECT stop_id FROM stops LIMIT 1")
+        cur.execute("""
+            INSERT INTO stop_events(trip_id, stop_id, scheduled, actual, passengers_on, passengers_off)
+            VALUES (%s, %s, '2026-01-15 08:00', '2026-01-15 08:03', 1, 0) RETURNING stop_event_id
+        """, (trip, stop))
+        event_id = cur.fetchone()[0]
+        assert scalar(cur, "SELECT COUNT(*) FROM stop_events_default") == 1
+        cur.execute("SELECT ensure_stop_event_partitions('2025-12-31', '2026-01-31')")
+        assert scalar(cur, "SELECT COUNT(*) FROM stop_events_default") == 0
+        assert scalar(cur, "SELECT stop_event_id FROM stop_events_2026_01") == event_id
+        assert scalar(cur, "SELECT to_regclass('stop_events_2025_12') IS NOT NULL")
+        # the default partition is attached again
+        assert scalar(cur, """
+            SELECT COUNT(*) FROM pg_inherits
+            WHERE inhparent = 'stop_events'::regclass AND inhrelid = 'stop_events_default'::regclass
+        """) == 1
+
+if __name__ == '__main__':
+    test_row_then_copy_load()
+    test_default_rows_move_to_new_partition()
+    print("schema_prod load tests passed")
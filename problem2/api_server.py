@@ -1,83 +1,469 @@
 #!/usr/bin/env python3
 # problem2/api_server.py
-import json, sys, argparse, urllib.parse
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import gzip, hashlib, json, sys, argparse, queue, threading, time, urllib.parse, zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 import boto3
 from boto3.dynamodb.conditions import Key
+from metrics import instrument, registry, scope
+from query_papers import (BATCH_GET_MAX, category_page, category_partitions, fetch_paper, fetch_papers,
+                          keyword_partitions, multi_query, query_page)
+try:
+    import orjson  # optional: several times faster than json for large result pages
+except ImportError:
+    orjson = None
+
+_session = None
+_session_lock = threading.Lock()
 
 def get_table(name, region=None):
-    resource = boto3.resource('dynamodb', region_name=region) if region else boto3.resource('dynamodb')
-    return resource.Table(name)
+    # one shared session (loaded service models are reused); creating resources from it is
+    # not thread-safe, so it is serialized
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        table = _session.resource('dynamodb', region_name=region).Table(name)
+    instrument(table.meta.client)
+    return table
 
-def json_response(handler, status, payload):
-    data = json.dumps(payload, default=str).encode('utf-8')
+class TablePool:
+    """Caps how many requests talk to DynamoDB at once. boto3 resources are not thread-safe,
+    so each in-flight request checks out its own Table handle; handles are created lazily
+    and reused for the life of the process."""
+    def __init__(self, name, region=None, size=1):
+        self.name, self.region = name, region
+        self.slots = threading.BoundedSemaphore(size)
+        self.free = queue.LifoQueue()
+
+    @contextmanager
+    def table(self):
+        with self.slots:
+            try:
+                table = self.free.get_nowait()
+            except queue.Empty:
+                table = get_table(self.name, self.region)
+            try:
+                yield table
+            finally:
+                self.free.put(table)
+
+class ResponseCache:
+    """Thread-safe LRU of encoded responses with a per-entry expiry."""
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, prefix=''):
+        with self.lock:
+            doomed = [k for k in self.entries if k.startswith(prefix)]
+            for k in doomed:
+                del self.entries[k]
+            return len(doomed)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expired": self.expired,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+# seconds a cached response stays valid, per route
+CACHE_TTL = {'recent': 60, 'author': 300, 'paper': 3600, 'search': 300, 'keyword': 300,
+             'keywords': 300, 'categories': 60}
+cache = ResponseCache()
+
+def cache_metrics():
+    st = cache.stats()
+    return [
+        ('api_cache_hits_total', 'counter', 'Response cache hits.', [((), st['hits'])]),
+        ('api_cache_misses_total', 'counter', 'Response cache misses.', [((), st['misses'])]),
+        ('api_cache_evictions_total', 'counter', 'Entries evicted by the LRU bound.', [((), st['evictions'])]),
+        ('api_cache_expired_total', 'counter', 'Entries dropped on lookup after their TTL.', [((), st['expired'])]),
+        ('api_cache_entries', 'gauge', 'Entries currently cached.', [((), st['entries'])]),
+        ('api_cache_hit_ratio', 'gauge', 'hits / (hits + misses) since start.', [((), st['hit_rate'] or 0)]),
+    ]
+
+registry.collectors.append(cache_metrics)
+
+def normalize_path(path):
+    # each segment decoded and re-quoted as a whole: %41 and A share a key, but A%2FB and A/B
+    # (one author segment vs two segments) do not
+    return '/' + '/'.join(urllib.parse.quote(urllib.parse.unquote(p), safe='') for p in path.split('/') if p)
+
+def cache_key(parsed):
+    """Normalized path (canonically encoded, no empty segments) plus the query string sorted by key."""
+    qs = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)))
+    return normalize_path(parsed.path) + ('?' + qs if qs else '')
+
+def json_default(o):
+    # boto3 returns every number as Decimal
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    return str(o)
+
+# ASCII output: the C encoder's escaping path is faster than encoding a non-ASCII str to UTF-8
+_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'))
+
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=json_default)
+    return _encoder.encode(payload).encode('ascii')
+
+COMPRESS_MIN = 1024  # smaller bodies are sent as they are
+MAX_BODY = 1 << 20  # request bodies (POST /papers/batch takes at most 100 ids)
+ENCODINGS = ('gzip', 'deflate')  # preference order on equal q
+
+class Body:
+    """An encoded 200 body with its ETag and the compressed variants built so far. The response
+    cache stores these, so a hit re-encodes and re-compresses nothing."""
+    __slots__ = ('data', 'etag', 'variants')
+
+    def __init__(self, data):
+        self.data = data
+        # weak: the gzip/deflate variants are the same resource but not the same bytes
+        self.etag = 'W/"%s"' % hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.variants = {}
+
+    def encoded(self, coding):
+        if coding is None:
+            return self.data
+        v = self.variants.get(coding)
+        if v is None:
+            v = gzip.compress(self.data, 6, mtime=0) if coding == 'gzip' else zlib.compress(self.data, 6)
+            self.variants[coding] = v
+        return v
+
+def negotiate(accept_encoding):
+    """Best content-coding we support in an Accept-Encoding header, or None for identity."""
+    q = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        weight = 1.0
+        for param in params.split(';'):
+            k, _, v = param.strip().partition('=')
+            if k == 'q':
+                try:
+                    weight = float(v)
+                except ValueError:
+                    weight = 0.0
+        if coding == '*':
+            for c in ENCODINGS:
+                q.setdefault(c, weight)
+        elif coding in ENCODINGS:
+            q[coding] = weight
+    best = max(ENCODINGS, key=lambda c: (q.get(c, 0), -ENCODINGS.index(c)))
+    return best if q.get(best, 0) > 0 else None
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    # If-None-Match uses the weak comparison
+    return '*' in tags or etag[2:] in (t[2:] if t.startswith('W/') else t for t in tags)
+
+def send_json(handler, status, data, headers=None, content_type='application/json'):
     handler.send_response(status)
-    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Type', content_type)
     handler.send_header('Content-Length', str(len(data)))
+    for k, v in (headers or {}).items():
+        handler.send_header(k, v)
     handler.end_headers()
     handler.wfile.write(data)
+    handler.sent = (status, len(data))
+
+def send_body(handler, body, headers=None):
+    """200 with ETag and negotiated compression, or 304 when If-None-Match already has it."""
+    headers = dict(headers or {}, ETag=body.etag, Vary='Accept-Encoding')
+    if etag_matches(handler.headers.get('If-None-Match'), body.etag):
+        handler.send_response(304)
+        for k, v in headers.items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.sent = (304, 0)
+        return
+    coding = negotiate(handler.headers.get('Accept-Encoding')) if len(body.data) >= COMPRESS_MIN else None
+    if coding:
+        headers['Content-Encoding'] = coding
+    send_json(handler, 200, body.encoded(coding), headers)
+
+def json_response(handler, status, payload):
+    send_json(handler, status, encode_json(payload))
+
+# author/search have no natural bound, so they are paged like the other routes
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 1000
+
+def page_limit(qs, default):
+    return max(1, min(int(qs.get('limit', [str(default)])[0]), MAX_PAGE_LIMIT))
+
+def paged(payload, items, next_token):
+    payload.update(papers=items, count=len(items))
+    if next_token:
+        payload['next_token'] = next_token
+    return payload
+
+def match(parts):
+    """Route name for a /papers path (None when unmatched); search and the multi routes are
+    matched before the /papers/<id> catch-all. Names are one segment (a '/' in one is %2F)."""
+    if parts[:2] == ['papers','recent']:
+        return 'recent'
+    if parts[:2] == ['papers','author'] and len(parts) == 3:
+        return 'author'
+    if parts[:2] == ['papers','search']:
+        return 'search'
+    if parts[:2] in (['papers','keywords'], ['papers','categories']) and len(parts) == 2:
+        return parts[1]
+    if parts[:1] == ['papers'] and len(parts) == 2:
+        return 'paper'
+    if parts[:2] == ['papers','keyword'] and len(parts) == 3:
+        return 'keyword'
+    return None
+
+def route(table, parts, qs, shards=1):
+    """(route name, status, payload) for a /papers request; route is None when unmatched.
+    List routes take ?limit= and ?next_token= and return next_token while more pages remain.
+    shards is the loader's --category-shards; recent/search scatter-gather over the shards."""
+    token = qs.get('next_token', [None])[0]
+    name = match(parts)
+    if name == 'recent':
+        category = qs.get('category', ['cs.LG'])[0]
+        items, nxt = category_page(table, category, shards, page_limit(qs, 20), token)
+        return 'recent', 200, paged({"category": category}, items, nxt)
+
+    elif name == 'author':
+        author_name = urllib.parse.unquote(parts[2])
+        items, nxt = query_page(table, page_limit(qs, DEFAULT_PAGE_LIMIT), token,
+                                IndexName='AuthorIndex', KeyConditionExpression=Key('GSI1PK').eq(f'AUTHOR#{author_name}'))
+        return 'author', 200, paged({"author": author_name}, items, nxt)
+
+    elif name == 'search':
+        category = qs.get('category', ['cs.LG'])[0]
+        start = qs.get('start', ['0000-01-01'])[0]
+        end   = qs.get('end',   ['9999-12-31'])[0]
+        items, nxt = category_page(table, category, shards, page_limit(qs, DEFAULT_PAGE_LIMIT), token, newest_first=False,
+                                   sk_condition=Key('SK').between(f'{start}#', f'{end}#zzzzzzz'))
+        return 'search', 200, paged({"category": category, "start": start, "end": end}, items, nxt)
+
+    elif name in ('keywords', 'categories'):
+        # several keywords/categories combined with ?op=and|or; paged with ?before=<next_before>
+        kind = parts[1]
+        values = [v for v in qs.get('terms' if kind == 'keywords' else 'categories', [''])[0].split(',') if v]
+        op = qs.get('op', ['or'])[0]
+        if not values or op not in ('and', 'or'):
+            raise ValueError(f"need a comma-separated {'terms' if kind == 'keywords' else 'categories'} list and op=and|or")
+        partitions = keyword_partitions(values) if kind == 'keywords' else category_partitions(values, shards)
+        items, before = multi_query(table, partitions, op, page_limit(qs, 20), qs.get('before', [None])[0])
+        payload = {kind: values, "op": op, "papers": items, "count": len(items)}
+        if before:
+            payload['next_before'] = before
+        return kind, 200, payload
+
+    elif name == 'paper':
+        arxiv_id = urllib.parse.unquote(parts[1])
+        item = fetch_paper(table, arxiv_id)
+        if item:
+            return 'paper', 200, item
+        return 'paper', 404, {"error": "Paper not found"}
+
+    elif name == 'keyword':
+        kw = urllib.parse.unquote(parts[2])
+        items, nxt = query_page(table, page_limit(qs, 20), token,
+                                IndexName='KeywordIndex', KeyConditionExpression=Key('GSI3PK').eq(f'KEYWORD#{kw.lower()}'),
+                                ScanIndexForward=False)
+        return 'keyword', 200, paged({"keyword": kw}, items, nxt)
+
+    return None, 404, {"error": "Not found"}
 
 class Handler(BaseHTTPRequestHandler):
     table_name = "arxiv-papers"
     region = None
+    tables = None
+    category_shards = 1
+    admin = False
+
+    @contextmanager
+    def observed(self, route):
+        """Records latency, status and body size of one request for /metrics; the handler
+        renames self.route once it knows the route."""
+        self.route, self.cache_outcome, self.sent = route, 'miss', (0, 0)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            status, nbytes = self.sent
+            registry.observe_request(self.route, status, time.perf_counter() - t0, nbytes, self.cache_outcome)
 
     def do_GET(self):
+        with self.observed('unmatched'):
+            self.get()
+
+    def get(self):
         try:
             parsed = urllib.parse.urlparse(self.path)
             qs = urllib.parse.parse_qs(parsed.query)
             parts = [p for p in parsed.path.split('/') if p]
-            table = get_table(self.table_name, self.region)
-
-            if parts[:2] == ['papers','recent']:
-                category = qs.get('category', ['cs.LG'])[0]
-                limit = int(qs.get('limit', ['20'])[0])
-                resp = table.query(KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}'),
-                                   ScanIndexForward=False, Limit=limit)
-                json_response(self, 200, {"category": category, "papers": resp.get('Items',[]), "count": len(resp.get('Items',[]))})
-
-            elif parts[:2] == ['papers','author'] and len(parts) >= 3:
-                author_name = urllib.parse.unquote(parts[2])
-                resp = table.query(IndexName='AuthorIndex', KeyConditionExpression=Key('GSI1PK').eq(f'AUTHOR#{author_name}'))
-                json_response(self, 200, {"author": author_name, "papers": resp.get('Items',[]), "count": len(resp.get('Items',[]))})
-
-            elif parts[:1] == ['papers'] and len(parts) == 2:
-                arxiv_id = urllib.parse.unquote(parts[1])
-                resp = table.query(IndexName='PaperIdIndex', KeyConditionExpression=Key('GSI2PK').eq(f'PAPER#{arxiv_id}'))
-                items = resp.get('Items',[])
-                if items:
-                    json_response(self, 200, items[0])
-                else:
-                    json_response(self, 404, {"error": "Paper not found"})
-
-            elif parts[:2] == ['papers','search']:
-                category = qs.get('category', ['cs.LG'])[0]
-                start = qs.get('start', ['0000-01-01'])[0]
-                end   = qs.get('end',   ['9999-12-31'])[0]
-                resp = table.query(KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}') & Key('SK').between(f'{start}#', f'{end}#zzzzzzz'))
-                json_response(self, 200, {"category": category, "start": start, "end": end, "papers": resp.get('Items',[]), "count": len(resp.get('Items',[]))})
-
-            elif parts[:2] == ['papers','keyword'] and len(parts) >= 3:
-                kw = urllib.parse.unquote(parts[2])
-                limit = int(qs.get('limit', ['20'])[0])
-                resp = table.query(IndexName='KeywordIndex', KeyConditionExpression=Key('GSI3PK').eq(f'KEYWORD#{kw.lower()}'),
-                                   ScanIndexForward=False, Limit=limit)
-                json_response(self, 200, {"keyword": kw, "papers": resp.get('Items',[]), "count": len(resp.get('Items',[]))})
-
-            else:
+
+            if parts == ['metrics']:
+                self.route = 'metrics'
+                send_json(self, 200, registry.render().encode('utf-8'), content_type='text/plain; version=0.0.4; charset=utf-8')
+                return
+            if parts == ['cache', 'stats']:
+                self.route = 'cache_stats'
+                json_response(self, 200, cache.stats())
+                return
+
+            self.route = match(parts) or 'unmatched'
+            key = cache_key(parsed)
+            hit = cache.get(key)
+            if hit is not None:
+                self.cache_outcome = 'hit'
+                send_body(self, hit, {'X-Cache': 'HIT'})
+                return
+            try:
+                with self.tables.table() as table, scope(self.route):
+                    name, status, payload = route(table, parts, qs, self.category_shards)
+            except ValueError as e:
+                # bad limit or next_token
+                json_response(self, 400, {"error": str(e)})
+                return
+            if status != 200:
+                send_json(self, status, encode_json(payload), {'X-Cache': 'MISS'} if name else None)
+                return
+            body = Body(encode_json(payload))
+            cache.put(key, body, CACHE_TTL[name])
+            send_body(self, body, {'X-Cache': 'MISS'})
+        except Exception as e:
+            json_response(self, 500, {"error": str(e)})
+
+    def do_POST(self):
+        with self.observed('unmatched'):
+            self.post()
+
+    def read_body(self):
+        """The request body. It is read before any response, whatever the route or error, so on a
+        keep-alive connection it is never parsed as the next request; a body that cannot be
+        read (bad or oversized Content-Length) closes the connection instead."""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY:
+            self.close_connection = True
+            raise ValueError("invalid Content-Length" if length < 0 else f"request body over {MAX_BODY} bytes")
+        return self.rfile.read(length)
+
+    def post(self):
+        # POST /papers/batch {"ids": [...]} -> papers in request order plus the ids not found
+        try:
+            try:
+                raw = self.read_body()
+            except ValueError as e:
+                json_response(self, 400, {"error": str(e)})
+                return
+            parts = [p for p in urllib.parse.urlparse(self.path).path.split('/') if p]
+            if parts != ['papers', 'batch']:
                 json_response(self, 404, {"error": "Not found"})
+                return
+            self.route = 'batch'
+            try:
+                body = json.loads(raw or b'{}')
+                ids = body.get('ids') if isinstance(body, dict) else None
+                if not isinstance(ids, list) or not all(isinstance(i, str) and i for i in ids):
+                    raise ValueError('body must be {"ids": [<arxiv id>, ...]}')
+                if len(ids) > BATCH_GET_MAX:
+                    raise ValueError(f"at most {BATCH_GET_MAX} ids per request")
+            except ValueError as e:
+                json_response(self, 400, {"error": str(e)})
+                return
+            with self.tables.table() as table, scope('batch'):
+                items = fetch_papers(table, ids)
+            send_body(self, Body(encode_json({"papers": [it for it in items if it is not None],
+                                              "missing": [i for i, it in zip(ids, items) if it is None],
+                                              "count": sum(it is not None for it in items)})))
         except Exception as e:
             json_response(self, 500, {"error": str(e)})
 
+    def do_DELETE(self):
+        # DELETE /cache?prefix=/papers/recent drops matching entries; no prefix clears everything.
+        # Unauthenticated, so only served with --admin.
+        try:
+            self.read_body()
+        except ValueError as e:
+            json_response(self, 400, {"error": str(e)})
+            return
+        parsed = urllib.parse.urlparse(self.path)
+        if [p for p in parsed.path.split('/') if p] != ['cache']:
+            json_response(self, 404, {"error": "Not found"})
+            return
+        if not self.admin:
+            json_response(self, 403, {"error": "cache invalidation is disabled (start the server with --admin)"})
+            return
+        prefix = urllib.parse.parse_qs(parsed.query).get('prefix', [''])[0]
+        if prefix:
+            prefix = normalize_path(prefix)
+        json_response(self, 200, {"invalidated": cache.invalidate(prefix), "prefix": prefix})
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("port", nargs="?", default=8080, type=int)
     ap.add_argument("--table", default="arxiv-papers")
     ap.add_argument("--region", default=None)
+    ap.add_argument("--cache-size", type=int, default=1024, help="Max cached responses (0 disables the cache)")
+    ap.add_argument("--workers", type=int, default=16,
+                    help="Requests served against DynamoDB at once (1 = original one-request-at-a-time server)")
+    ap.add_argument("--keepalive-timeout", type=float, default=15.0, help="Seconds before an idle keep-alive connection is closed")
+    ap.add_argument("--category-shards", type=int, default=1,
+                    help="Shards per category, as loaded with load_data.py --category-shards")
+    ap.add_argument("--admin", action="store_true",
+                    help="Serve DELETE /cache (unauthenticated; only on a trusted network)")
     args = ap.parse_args()
+    Handler.admin = args.admin
     Handler.table_name = args.table
     Handler.region = args.region
-    server = HTTPServer(("0.0.0.0", args.port), Handler)
-    print(f"Serving on 0.0.0.0:{args.port} -> table={args.table} region={args.region}")
+    Handler.category_shards = args.category_shards
+    Handler.tables = TablePool(args.table, args.region, max(args.workers, 1))
+    cache.max_entries = args.cache_size
+    if args.workers > 1:
+        # a thread per HTTP/1.1 keep-alive connection; TablePool bounds the DynamoDB work
+        Handler.protocol_version = 'HTTP/1.1'
+        Handler.timeout = args.keepalive_timeout
+        Handler.disable_nagle_algorithm = True  # headers and body go out as separate writes
+        ThreadingHTTPServer.request_queue_size = 128
+        server = ThreadingHTTPServer(("0.0.0.0", args.port), Handler)
+    else:
+        server = HTTPServer(("0.0.0.0", args.port), Handler)
+    print(f"Serving on 0.0.0.0:{args.port} -> table={args.table} region={args.region} workers={args.workers}")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
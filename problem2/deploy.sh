@@ -9,7 +9,7 @@ fi
 KEY_FILE="$1"
 EC2_IP="$2"
 echo "Deploying to EC2 instance: $EC2_IP"
-scp -i "$KEY_FILE" api_server.py ec2-user@"$EC2_IP":~
+scp -i "$KEY_FILE" api_server.py query_papers.py metrics.py ec2-user@"$EC2_IP":~
 scp -i "$KEY_FILE" requirements.txt ec2-user@"$EC2_IP":~
 ssh -i "$KEY_FILE" ec2-user@"$EC2_IP" << 'EOF'
   python3 -m pip install -r requirements.txt --user
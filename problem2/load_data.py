@@ -1,27 +1,159 @@
 #!/usr/bin/env python3
 # problem2/load_data.py
-import argparse, json, re
-from collections import Counter
+import argparse, gzip, heapq, json, math, queue, random, re, sys, threading, time, zlib
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import boto3
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from metrics import instrument, print_summary
 
-STOPWORDS = {
+BATCH_SIZE = 25  # BatchWriteItem limit
+SERIALIZER = TypeSerializer()
+DESERIALIZER = TypeDeserializer()
+
+STOPWORDS = frozenset({
     'the','a','an','and','or','but','in','on','at','to','for','of','with','by','from','up','about','into','through','during',
     'is','are','was','were','be','been','being','have','has','had','do','does','did','will','would','could','should','may','might',
     'can','this','that','these','those','we','our','use','using','based','approach','method','paper','propose','proposed','show'
-}
+})
+TOKEN_RE = re.compile(r"[a-z0-9]+")
 
 def normalize_kw(text):
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9\s]", " ", text)
-    toks = [t for t in text.split() if t and t not in STOPWORDS and len(t) > 2]
-    return toks
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 2 and t not in STOPWORDS]
 
-def top_keywords(abstract, k=10):
+def top_keywords(abstract, k=10, idf=None):
+    """Top-k terms by frequency, or by tf*idf when corpus idf weights are given (terms not
+    in idf get the weight of a term seen once). Ties keep first-occurrence order."""
     cnt = Counter(normalize_kw(abstract or ""))
-    return [w for w,_ in cnt.most_common(k)]
+    if idf is None:
+        return [w for w,_ in cnt.most_common(k)]
+    rare = idf.get('', 1.0)
+    score = {w: c * idf.get(w, rare) for w, c in cnt.items()}
+    return heapq.nlargest(k, score, key=score.get)
+
+# Keyword stage: runs in the writer's thread by default, or on a process pool fed by a
+# producer thread that stays up to KW_PREFETCH chunks ahead of the DynamoDB writes.
+KW_CHUNK = 256
+KW_PREFETCH = 8
+_idf = None
+
+def _init_keywords(idf):
+    global _idf
+    _idf = idf
+
+def extract_chunk(abstracts, k=10):
+    return [top_keywords(a, k, _idf) for a in abstracts]
+
+def df_chunk(abstracts):
+    df = Counter()
+    for a in abstracts:
+        df.update(set(normalize_kw(a or "")))
+    return len(abstracts), df
+
+def chunked(iterable, size):
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def document_frequencies(papers, workers=0):
+    """First TF-IDF pass: smoothed idf per term over the whole corpus. The '' entry holds
+    the weight used for terms missing from the table."""
+    df, n = Counter(), 0
+    abstracts = ([p.get('abstract') for p in c] for c in chunked(papers, KW_CHUNK))
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in abstracts:
+                pending.append(pool.submit(df_chunk, chunk))
+                if len(pending) > KW_PREFETCH:
+                    n_chunk, chunk_df = pending.popleft().result()
+                    n += n_chunk; df.update(chunk_df)
+            for fut in pending:
+                n_chunk, chunk_df = fut.result()
+                n += n_chunk; df.update(chunk_df)
+    else:
+        for chunk in abstracts:
+            n_chunk, chunk_df = df_chunk(chunk)
+            n += n_chunk; df.update(chunk_df)
+    idf = {w: math.log((1 + n) / (1 + c)) + 1 for w, c in df.items()}
+    idf[''] = math.log(1 + n) + 1
+    return n, idf
+
+def keyword_stage(papers, k=10, workers=0, idf=None):
+    """Yield (paper, keywords) in input order."""
+    if workers <= 0:
+        for p in papers:
+            yield p, top_keywords(p.get('abstract'), k, idf)
+        return
+    q = queue.Queue(maxsize=KW_PREFETCH)
+    done = object()
+    stop = threading.Event()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_keywords, initargs=(idf,)) as pool:
+        def offer(x):
+            while not stop.is_set():
+                try:
+                    q.put(x, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for chunk in chunked(papers, KW_CHUNK):
+                    if not offer((chunk, pool.submit(extract_chunk, [p.get('abstract') for p in chunk], k))):
+                        return
+                offer(done)
+            except BaseException as e:
+                offer(e)
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                got = q.get()
+                if got is done:
+                    break
+                if isinstance(got, BaseException):
+                    raise got
+                chunk, fut = got
+                yield from zip(chunk, fut.result())
+        finally:
+            stop.set()
+            producer.join()
+
+# compact layout: what author/keyword index items (and their GSIs) carry besides the keys
+COMPACT_PROJECTION = ['arxiv_id', 'title', 'published']
+ZLIB_MIN = 512  # abstracts shorter than this are stored as plain text
+
+def gsi_projections(compact):
+    if not compact:
+        return {'AuthorIndex': {'ProjectionType':'ALL'}, 'PaperIdIndex': {'ProjectionType':'ALL'}, 'KeywordIndex': {'ProjectionType':'ALL'}}
+    include = {'ProjectionType':'INCLUDE', 'NonKeyAttributes': COMPACT_PROJECTION}
+    return {'AuthorIndex': include, 'PaperIdIndex': {'ProjectionType':'KEYS_ONLY'}, 'KeywordIndex': include}
 
-def create_table(dynamodb, table_name):
+def record_layout(dynamodb, table_name, compact):
+    """The TABLE#META/LAYOUT item readers check before falling back to PaperIdIndex (see
+    query_papers.compact_only). It only says compact while every load into the table was
+    --compact: a legacy load overwrites it up front, a compact one never overwrites legacy."""
+    item = {'PK': {'S': 'TABLE#META'}, 'SK': {'S': 'LAYOUT'}, 'layout': {'S': 'compact' if compact else 'legacy'}}
+    if not compact:
+        dynamodb.put_item(TableName=table_name, Item=item)
+        return
+    try:
+        dynamodb.put_item(TableName=table_name, Item=item, ConditionExpression='attribute_not_exists(PK) OR layout = :c',
+                          ExpressionAttributeValues={':c': {'S': 'compact'}})
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        print("Table also holds legacy-layout papers; readers keep the PaperIdIndex fallback")
+
+def create_table(dynamodb, table_name, compact=False):
+    proj = gsi_projections(compact)
     try:
         dynamodb.create_table(
             TableName=table_name,
@@ -37,9 +169,9 @@ def create_table(dynamodb, table_name):
                 {'AttributeName':'SK', 'KeyType':'RANGE'},
             ],
             GlobalSecondaryIndexes=[
-                {'IndexName':'AuthorIndex','KeySchema':[{'AttributeName':'GSI1PK','KeyType':'HASH'},{'AttributeName':'SK','KeyType':'RANGE'}],'Projection':{'ProjectionType':'ALL'},'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
-                {'IndexName':'PaperIdIndex','KeySchema':[{'AttributeName':'GSI2PK','KeyType':'HASH'}],'Projection':{'ProjectionType':'ALL'},'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
-                {'IndexName':'KeywordIndex','KeySchema':[{'AttributeName':'GSI3PK','KeyType':'HASH'},{'AttributeName':'SK','KeyType':'RANGE'}],'Projection':{'ProjectionType':'ALL'},'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
+                {'IndexName':'AuthorIndex','KeySchema':[{'AttributeName':'GSI1PK','KeyType':'HASH'},{'AttributeName':'SK','KeyType':'RANGE'}],'Projection':proj['AuthorIndex'],'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
+                {'IndexName':'PaperIdIndex','KeySchema':[{'AttributeName':'GSI2PK','KeyType':'HASH'}],'Projection':proj['PaperIdIndex'],'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
+                {'IndexName':'KeywordIndex','KeySchema':[{'AttributeName':'GSI3PK','KeyType':'HASH'},{'AttributeName':'SK','KeyType':'RANGE'}],'Projection':proj['KeywordIndex'],'ProvisionedThroughput':{'ReadCapacityUnits':5,'WriteCapacityUnits':5}},
             ],
             BillingMode='PROVISIONED',
             ProvisionedThroughput={'ReadCapacityUnits':5,'WriteCapacityUnits':5}
@@ -52,89 +184,375 @@ def create_table(dynamodb, table_name):
         else:
             raise
 
-def batch_write(table, items):
-    with table.batch_writer(overwrite_by_pkeys=['PK','SK']) as bw:
+AUTHOR_SEP = re.compile(r',\s*(?:and\s+)?|\s+and\s+')
+
+def paper_fields(p):
+    fields = {
+        'arxiv_id': p.get('id') or p.get('arxiv_id') or p.get('paper_id') or '',
+        'title': (p.get('title') or '').strip(),
+        'authors': p.get('authors') or p.get('author_list') or [],
+        'abstract': p.get('abstract') or '',
+        'categories': p.get('categories') or p.get('category_list') or [],
+        'published': str(p.get('published') or p.get('date') or p.get('updated') or p.get('update_date') or ''),
+    }
+    # arXiv metadata snapshots carry these as plain strings
+    if isinstance(fields['authors'], str):
+        fields['authors'] = [a.strip() for a in AUTHOR_SEP.split(fields['authors']) if a.strip()]
+    if isinstance(fields['categories'], str):
+        fields['categories'] = fields['categories'].split()
+    return fields
+
+def category_pk(category, arxiv_id, shards=1):
+    """CATEGORY#<cat>, or CATEGORY#<cat>#<n> when category writes are spread over `shards`
+    partitions; n is crc32 of the arXiv id, so a reload puts a paper in the same shard."""
+    if shards <= 1:
+        return f'CATEGORY#{category}'
+    return f"CATEGORY#{category}#{zlib.crc32(arxiv_id.encode('utf-8')) % shards}"
+
+def legacy_items(f, keywords, shards=1):
+    """(kind, item) for every item the original layout writes for one paper."""
+    home = category_pk(f['categories'][0] if f['categories'] else 'unknown', f['arxiv_id'], shards)
+    sk = f"{f['published'][:10]}#{f['arxiv_id']}"
+    brief = {'arxiv_id': f['arxiv_id'], 'title': f['title'], 'authors': f['authors'], 'published': f['published']}
+    out = []
+    for c in f['categories']:
+        out.append(('categories', {
+            'PK': category_pk(c, f['arxiv_id'], shards), 'SK': sk,
+            'arxiv_id': f['arxiv_id'], 'title': f['title'], 'authors': f['authors'],
+            'abstract': f['abstract'], 'categories': f['categories'], 'keywords': keywords, 'published': f['published'],
+        }))
+    for a in f['authors']:
+        out.append(('authors', {'PK': home, 'SK': sk, 'GSI1PK': f'AUTHOR#{a}', **brief}))
+    out.append(('by_id', {'PK': home, 'SK': sk, 'GSI2PK': f"PAPER#{f['arxiv_id']}", **brief}))
+    for kw in keywords:
+        out.append(('keywords', {'PK': home, 'SK': sk, 'GSI3PK': f'KEYWORD#{kw.lower()}', **brief}))
+    return out
+
+def compact_items(f, keywords, shards=1):
+    """(kind, item) for the compact layout: the body is stored once under PAPER#<id>/PAPER
+    and read with GetItem (so it stays out of PaperIdIndex), category items carry a listing
+    projection and author/keyword items only COMPACT_PROJECTION. Author/keyword items live in
+    the paper's own partition with distinct sort keys that still begin with date#id, so the
+    GSIs sort as before."""
+    pid = f"PAPER#{f['arxiv_id']}"
+    sk = f"{f['published'][:10]}#{f['arxiv_id']}"
+    body = {'PK': pid, 'SK': 'PAPER',
+            'arxiv_id': f['arxiv_id'], 'title': f['title'], 'authors': f['authors'],
+            'categories': f['categories'], 'keywords': keywords, 'published': f['published']}
+    raw = f['abstract'].encode('utf-8')
+    packed = zlib.compress(raw, 6) if len(raw) >= ZLIB_MIN else raw
+    if len(packed) < len(raw):
+        body['abstract_z'] = packed
+    elif raw:
+        body['abstract'] = f['abstract']
+    brief = {k: f[k] for k in COMPACT_PROJECTION}
+    out = [('body', body)]
+    for c in f['categories']:
+        out.append(('categories', {'PK': category_pk(c, f['arxiv_id'], shards), 'SK': sk, **brief, 'authors': f['authors']}))
+    for a in f['authors']:
+        out.append(('authors', {'PK': pid, 'SK': f'{sk}#AUTHOR#{a}', 'GSI1PK': f'AUTHOR#{a}', **brief}))
+    for kw in keywords:
+        out.append(('keywords', {'PK': pid, 'SK': f'{sk}#KEYWORD#{kw.lower()}', 'GSI3PK': f'KEYWORD#{kw.lower()}', **brief}))
+    return out
+
+def unique_items(kind_items):
+    """(kind, item) of the last item per (PK, SK): what is actually written. Legacy author/id/
+    keyword items reuse the key of the first category item, so they overwrite one another the
+    way batch_writer(overwrite_by_pkeys) did."""
+    unique = {}
+    for kind, it in kind_items:
+        unique[(it['PK'], it['SK'])] = (kind, it)
+    return list(unique.values())
+
+def attr_size(v):
+    # DynamoDB item size rules: UTF-8 strings, raw binary, ~1 byte per 2 digits for numbers,
+    # 3 bytes + 1 per element of overhead for lists/maps
+    if isinstance(v, str):
+        return len(v.encode('utf-8'))
+    if isinstance(v, Binary):
+        return len(v.value)
+    if isinstance(v, (bytes, bytearray)):
+        return len(v)
+    if isinstance(v, bool) or v is None:
+        return 1
+    if isinstance(v, (int, float)):
+        return len(str(v)) // 2 + 1
+    if isinstance(v, dict):
+        return 3 + sum(len(k.encode('utf-8')) + attr_size(x) + 1 for k, x in v.items())
+    return 3 + sum(attr_size(x) + 1 for x in v)
+
+def item_size(item, attrs=None):
+    return sum(len(k.encode('utf-8')) + attr_size(v) for k, v in item.items() if attrs is None or k in attrs)
+
+GSI_KEYS = {'AuthorIndex': ('GSI1PK', 'SK'), 'PaperIdIndex': ('GSI2PK',), 'KeywordIndex': ('GSI3PK', 'SK')}
+
+class Footprint:
+    """Items, bytes and WCU a layout writes (base table plus every GSI it projects into)."""
+    def __init__(self, compact):
+        self.projections = gsi_projections(compact)
+        self.items = self.bytes = self.wcu = 0
+
+    def add(self, items):
         for it in items:
-            bw.put_item(Item=it)
+            size = item_size(it)
+            self.items += 1
+            self.bytes += size
+            self.wcu += math.ceil(size / 1024)
+            for index, keys in GSI_KEYS.items():
+                if keys[0] not in it:
+                    continue
+                proj = self.projections[index]
+                attrs = None
+                if proj['ProjectionType'] != 'ALL':
+                    attrs = {'PK', 'SK', *keys, *proj.get('NonKeyAttributes', [])}
+                size = item_size(it, attrs)
+                self.bytes += size
+                self.wcu += math.ceil(size / 1024)
+
+def batches(items, size=BATCH_SIZE):
+    """Full BatchWriteItem-sized groups across papers. A request may not repeat a key, so a
+    later item with a key already in the open batch replaces it (last write wins)."""
+    batch = {}
+    for it in items:
+        batch[(it['PK'], it['SK'])] = it
+        if len(batch) == size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+class WriteStats:
+    def __init__(self):
+        self.items = self.requests = self.retries = 0
+        self.wcu = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items=0, requests=0, retries=0, wcu=0.0):
+        with self.lock:
+            self.items += items; self.requests += requests; self.retries += retries; self.wcu += wcu
+
+class TokenBucket:
+    """WCU/sec limiter shared by all writer threads. A request takes its estimated cost up
+    front; settle() books the difference once the real ConsumedCapacity is known, so the
+    balance may go negative and later callers wait it off."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self, n):
+        n = min(n, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait_s = (n - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+    def settle(self, n):
+        with self.lock:
+            self.tokens -= n
+
+def estimate_wcu(request):
+    # 1 WCU per started KB of each item; GSI writes are only seen in ConsumedCapacity
+    return sum(math.ceil(item_size({k: DESERIALIZER.deserialize(v) for k, v in r['PutRequest']['Item'].items()}) / 1024)
+               for r in request)
+
+def write_batch(client, table_name, batch, stats, limiter=None, max_retries=8, base_delay=0.05, max_delay=5.0):
+    """One BatchWriteItem call; UnprocessedItems are resent with full-jitter exponential backoff."""
+    request = {table_name: [{'PutRequest': {'Item': {k: SERIALIZER.serialize(v) for k, v in it.items()}}} for it in batch]}
+    for attempt in range(max_retries + 1):
+        if attempt:
+            stats.add(retries=1)
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+        cost = estimate_wcu(request[table_name])
+        if limiter:
+            limiter.acquire(cost)
+        resp = client.batch_write_item(RequestItems=request, ReturnConsumedCapacity='TOTAL')
+        used = sum(c.get('CapacityUnits', 0) for c in resp.get('ConsumedCapacity', []))
+        if limiter:
+            limiter.settle(used - cost)
+        stats.add(requests=1, wcu=used)
+        request = resp.get('UnprocessedItems') or {}
+        if not request:
+            stats.add(items=len(batch))
+            return
+    left = sum(len(v) for v in request.values())
+    raise RuntimeError(f"{left} items still unprocessed after {max_retries} retries")
+
+def write_all(client, table_name, batches, stats, concurrency=1, limiter=None):
+    """Fan batches out over a thread pool sharing one client; at most 2x concurrency batches
+    are in flight so the item stream is never read far ahead of the writes."""
+    if concurrency <= 1:
+        for batch in batches:
+            write_batch(client, table_name, batch, stats, limiter)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for batch in batches:
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    f.result()
+            pending.add(pool.submit(write_batch, client, table_name, batch, stats, limiter))
+        for f in pending:
+            f.result()
 
-def load_papers(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    if isinstance(data, dict) and 'papers' in data:
-        data = data['papers']
-    return data
+WRAPPER = re.compile(r'\{\s*"papers"\s*:\s*\[')
+
+def iter_json_values(f, in_array, chunk_size=1 << 20):
+    """Yield top-level values one at a time from a text stream: the elements of a JSON array
+    (the opening '[' already consumed) or whitespace/newline separated values (JSONL).
+    The buffer only ever holds the value being decoded plus one read chunk."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (in_array and buf[pos] == ',')):
+            pos += 1
+        if in_array and pos < len(buf) and buf[pos] == ']':
+            return
+        if pos < len(buf):
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                if end < len(buf) or eof:
+                    yield value
+                    pos = end
+                    continue
+        elif eof:
+            if in_array:
+                raise ValueError("unterminated JSON array")
+            return
+        more = f.read(chunk_size)
+        eof = not more
+        buf = buf[pos:] + more
+        pos = 0
+
+class Chained:
+    """Read-through of an already consumed prefix followed by the rest of the file."""
+    def __init__(self, prefix, f):
+        self.prefix, self.f = prefix, f
+
+    def read(self, n):
+        if self.prefix:
+            out, self.prefix = self.prefix, ''
+            return out
+        return self.f.read(n)
+
+def iter_papers(path):
+    """Stream papers from JSONL, a JSON array, or a {"papers": [...]} object (optionally .gz)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        head = f.read(4096)
+        stripped = head.lstrip()
+        wrapper = WRAPPER.match(stripped)
+        if stripped.startswith('['):
+            rest, in_array = stripped[1:], True
+        elif wrapper:
+            rest, in_array = stripped[wrapper.end():], True
+        else:
+            rest, in_array = head, False
+        for value in iter_json_values(Chained(rest, f), in_array):
+            if isinstance(value, dict) and isinstance(value.get('papers'), list):
+                yield from value['papers']
+            else:
+                yield value
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("papers_json_path")
     ap.add_argument("table_name")
     ap.add_argument("--region", default=None)
+    ap.add_argument("--endpoint-url", default=None, help="e.g. http://localhost:8000 for DynamoDB Local or a moto server")
+    ap.add_argument("--concurrency", type=int, default=1, help="Writer threads sharing one client")
+    ap.add_argument("--wcu-rate", type=float, default=0, help="Target WCU/sec across all threads (0 = unlimited)")
+    ap.add_argument("--keywords", choices=['tf', 'tfidf'], default='tf',
+                    help="Rank abstract terms by raw frequency, or by tf*idf over the whole file (two passes)")
+    ap.add_argument("--keyword-workers", type=int, default=0,
+                    help="Processes for keyword extraction, run ahead of the writer (0 = inline)")
+    ap.add_argument("--compact", action="store_true",
+                    help="Store each paper body once (zlib abstract) with minimal index items and INCLUDE/KEYS_ONLY GSIs")
+    ap.add_argument("--category-shards", type=int, default=1,
+                    help="Spread each category over N partitions, CATEGORY#<cat>#<n> (readers need the same N)")
+    ap.add_argument("--stats", action="store_true",
+                    help="Print DynamoDB call counts, time and consumed WCU per table/GSI at the end")
     args = ap.parse_args()
 
-    dynamodb = boto3.client('dynamodb', region_name=args.region) if args.region else boto3.client('dynamodb')
-    resource = boto3.resource('dynamodb', region_name=args.region) if args.region else boto3.resource('dynamodb')
-
-    create_table(dynamodb, args.table_name)
-    table = resource.Table(args.table_name)
-
-    papers = load_papers(args.papers_json_path)
-    print(f"Loading {len(papers)} papers from {args.papers_json_path}...")
-
-    total_items = cat_items = author_items = kw_items = id_items = 0
-
-    for p in papers:
-        arxiv_id = p.get('id') or p.get('arxiv_id') or p.get('paper_id') or ''
-        title = (p.get('title') or '').strip()
-        authors = p.get('authors') or p.get('author_list') or []
-        abstract = p.get('abstract') or ''
-        categories = p.get('categories') or p.get('category_list') or []
-        published = p.get('published') or p.get('date') or p.get('updated') or ''
-
-        keywords = top_keywords(abstract, k=10)
-
-        cat_batch = []
-        for c in categories:
-            cat_batch.append({
-                'PK': f'CATEGORY#{c}', 'SK': f'{str(published)[:10]}#{arxiv_id}',
-                'arxiv_id': arxiv_id, 'title': title, 'authors': authors,
-                'abstract': abstract, 'categories': categories, 'keywords': keywords, 'published': str(published),
-            })
-        if cat_batch:
-            batch_write(table, cat_batch); cat_items += len(cat_batch); total_items += len(cat_batch)
-
-        a_batch = []
-        for a in authors:
-            a_batch.append({
-                'PK': f'CATEGORY#{categories[0]}' if categories else 'CATEGORY#unknown',
-                'SK': f'{str(published)[:10]}#{arxiv_id}',
-                'GSI1PK': f'AUTHOR#{a}',
-                'arxiv_id': arxiv_id, 'title': title, 'authors': authors, 'published': str(published),
-            })
-        if a_batch:
-            batch_write(table, a_batch); author_items += len(a_batch); total_items += len(a_batch)
-
-        pid = {
-            'PK': f'CATEGORY#{categories[0]}' if categories else 'CATEGORY#unknown',
-            'SK': f'{str(published)[:10]}#{arxiv_id}',
-            'GSI2PK': f'PAPER#{arxiv_id}',
-            'arxiv_id': arxiv_id, 'title': title, 'authors': authors, 'published': str(published),
-        }
-        batch_write(table, [pid]); id_items += 1; total_items += 1
-
-        k_batch = []
-        for kw in keywords:
-            k_batch.append({
-                'PK': f'CATEGORY#{categories[0]}' if categories else 'CATEGORY#unknown',
-                'SK': f'{str(published)[:10]}#{arxiv_id}',
-                'GSI3PK': f'KEYWORD#{kw.lower()}',
-                'arxiv_id': arxiv_id, 'title': title, 'authors': authors, 'published': str(published),
-            })
-        if k_batch:
-            batch_write(table, k_batch); kw_items += len(k_batch); total_items += len(k_batch)
-
-    print(f"Created items: total={total_items}, categories={cat_items}, authors={author_items}, keywords={kw_items}, by_id={id_items}")
-    if len(papers) > 0:
-        print(f"Denormalization factor: {round(total_items/len(papers),2)}x")
+    config = Config(max_pool_connections=max(10, args.concurrency * 2), retries={'mode': 'standard'})
+    dynamodb = boto3.client('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url, config=config)
+    if args.stats:
+        instrument(dynamodb)
+
+    create_table(dynamodb, args.table_name, args.compact)
+    if not args.compact:
+        record_layout(dynamodb, args.table_name, compact=False)
+
+    idf = None
+    if args.keywords == 'tfidf':
+        t0 = time.perf_counter()
+        n_docs, idf = document_frequencies(iter_papers(args.papers_json_path), args.keyword_workers)
+        print(f"Document frequencies: {n_docs} papers, {len(idf) - 1} terms in {time.perf_counter() - t0:.2f}s")
+
+    print(f"Loading papers from {args.papers_json_path}...")
+
+    created = Counter()
+    partitions = Counter()
+    n_papers = 0
+    before, after = Footprint(compact=False), Footprint(compact=True)
+    def items():
+        nonlocal n_papers
+        papers = iter_papers(args.papers_json_path)
+        for p, keywords in keyword_stage(papers, 10, args.keyword_workers, idf):
+            n_papers += 1
+            f = paper_fields(p)
+            # footprints and counts are of the items written, after same-key overwrites
+            legacy = unique_items(legacy_items(f, keywords, args.category_shards))
+            compact = unique_items(compact_items(f, keywords, args.category_shards))
+            before.add(it for _, it in legacy)
+            after.add(it for _, it in compact)
+            chosen = compact if args.compact else legacy
+            created.update(kind for kind, _ in chosen)
+            partitions.update(it['PK'] for kind, it in chosen if kind == 'categories')
+            yield from (it for _, it in chosen)
+
+    stats = WriteStats()
+    t0 = time.perf_counter()
+    limiter = TokenBucket(args.wcu_rate) if args.wcu_rate > 0 else None
+    write_all(dynamodb, args.table_name, batches(items()), stats, args.concurrency, limiter)
+    dt = time.perf_counter() - t0
+    if args.compact:
+        # only once every body item is written
+        record_layout(dynamodb, args.table_name, compact=True)
+
+    total_items = sum(created.values())
+    print(f"Loaded {n_papers} papers")
+    print(f"Created items: total={total_items}, " + ", ".join(f"{k}={v}" for k, v in created.items()))
+    if n_papers > 0:
+        print(f"Denormalization factor: {round(total_items/n_papers,2)}x")
+        print(f"Write footprint per paper, table + GSIs ({'compact' if args.compact else 'legacy'} layout written):")
+        for name, fp in (('legacy', before), ('compact', after)):
+            print(f"  {name:<8} items={fp.items / n_papers:.1f} bytes={fp.bytes / n_papers:,.0f} est_wcu={fp.wcu / n_papers:.1f}")
+    if partitions:
+        hot, n = partitions.most_common(1)[0]
+        print(f"Hottest category partition: {hot} with {n} of {sum(partitions.values())} category items "
+              f"({len(partitions)} partitions, --category-shards {args.category_shards})")
+    print(f"Wrote {stats.items} items in {stats.requests} BatchWriteItem requests ({stats.retries} retries) "
+          f"in {dt:.2f}s: {stats.items / dt if dt > 0 else 0:,.0f} items/s, "
+          f"consumed {stats.wcu:g} WCU ({stats.wcu / dt if dt > 0 else 0:,.1f} WCU/s)")
+    if args.stats:
+        print_summary(sys.stdout)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# problem2/load_test.py
+# Closed-loop load test for api_server.py: each client thread keeps one HTTP/1.1 connection
+# open and issues requests back to back for --duration seconds. Prints requests/sec and
+# latency percentiles for every concurrency level as one JSON line each.
+import argparse, http.client, itertools, json, threading, time, urllib.parse
+
+DEFAULT_PATHS = [
+    "/papers/recent?category=cs.LG&limit=10",
+    "/papers/author/Sanjeev%20Arora",
+    "/papers/2307.01189v2",
+    "/papers/keyword/transformer?limit=10",
+]
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def client(host, port, paths, deadline, bust_cache, latencies, errors, seq):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    for path in itertools.cycle(paths):
+        if time.perf_counter() >= deadline:
+            break
+        if bust_cache:
+            path += ('&' if '?' in path else '?') + f"_={next(seq)}"
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 500:
+                errors.append(resp.status)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if resp.getheader('Connection', '').lower() == 'close' or resp.version == 10:
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+
+def run_level(host, port, paths, clients, duration, bust_cache):
+    latencies, errors, seq = [], [], itertools.count()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client, args=(host, port, paths, deadline, bust_cache, latencies, errors, seq))
+               for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    ordered = sorted(latencies)
+    return {
+        "clients": clients, "requests": len(latencies), "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        **{f"p{p}_ms": round(percentile(ordered, p), 2) if ordered else None for p in (50, 95, 99)},
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8080")
+    ap.add_argument("--clients", default="1,16,64", help="Comma-separated concurrency levels")
+    ap.add_argument("--duration", type=float, default=10.0, help="Seconds per level")
+    ap.add_argument("--path", action="append", help="Repeatable; default is a mix of the GET routes")
+    ap.add_argument("--bust-cache", action="store_true",
+                    help="Append a unique query parameter so every request misses the response cache")
+    args = ap.parse_args()
+    url = urllib.parse.urlparse(args.url)
+    for n in (int(c) for c in args.clients.split(',')):
+        print(json.dumps(run_level(url.hostname, url.port or 80, args.path or DEFAULT_PATHS,
+                                   n, args.duration, args.bust_cache)), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# problem2/metrics.py
+# Instrumentation shared by api_server.py, query_papers.py and load_data.py. instrument()
+# hooks a boto3 client's event system so every DynamoDB call is counted and timed, and asks
+# for ReturnConsumedCapacity=INDEXES so consumed RCU/WCU can be split per table and GSI.
+# Calls are attributed to the scope() (route, CLI mode) active on the calling thread.
+import json, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CAPACITY_OPS = {'Query', 'Scan', 'GetItem', 'BatchGetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem'}
+READ_OPS = {'Query', 'Scan', 'GetItem', 'BatchGetItem'}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            yield ('+Inf' if le == float('inf') else repr(le)), total
+
+class Registry:
+    """All counters and histograms behind one lock; collectors add values owned elsewhere
+    (e.g. the response cache) at render time."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)                          # (route, status) -> n
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (route, cache) -> seconds
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))        # route -> bytes
+        self.calls = defaultdict(int)                             # (scope, operation) -> n
+        self.errors = defaultdict(int)                            # (operation, code) -> n
+        self.call_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # operation -> seconds
+        self.capacity = defaultdict(float)                        # (scope, table, index, read|write) -> units
+        self.collectors = []
+
+    def observe_request(self, route, status, seconds, nbytes, cache='miss'):
+        with self.lock:
+            self.requests[(route, str(status))] += 1
+            self.latency[(route, cache)].observe(seconds)
+            self.sizes[route].observe(nbytes)
+
+    def observe_call(self, operation, seconds, parsed, scope_name):
+        kind = 'read' if operation in READ_OPS else 'write'
+        with self.lock:
+            self.calls[(scope_name, operation)] += 1
+            self.call_latency[operation].observe(seconds)
+            error = (parsed or {}).get('Error', {}).get('Code')
+            if error:
+                self.errors[(operation, error)] += 1
+            for table, index, units in consumed(parsed or {}):
+                self.capacity[(scope_name, table, index, kind)] += units
+
+    def observe_error(self, operation, code):
+        with self.lock:
+            self.errors[(operation, code)] += 1
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        out = []
+        def family(name, kind, help_text):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+        def histogram(name, labels, h):
+            for le, n in h.cumulative():
+                out.append(f"{name}_bucket{fmt_labels(labels + (('le', le),))} {n}")
+            out.append(f"{name}_sum{fmt_labels(labels)} {h.sum:g}")
+            out.append(f"{name}_count{fmt_labels(labels)} {h.count}")
+        with self.lock:
+            family('api_requests_total', 'counter', 'HTTP requests by route and status.')
+            for (route, status), n in sorted(self.requests.items()):
+                out.append(f"api_requests_total{fmt_labels((('route', route), ('status', status)))} {n}")
+            family('api_request_duration_seconds', 'histogram', 'Request latency by route and response cache outcome.')
+            for (route, cache), h in sorted(self.latency.items()):
+                histogram('api_request_duration_seconds', (('route', route), ('cache', cache)), h)
+            family('api_response_size_bytes', 'histogram', 'Response body size by route.')
+            for route, h in sorted(self.sizes.items()):
+                histogram('api_response_size_bytes', (('route', route),), h)
+            family('dynamodb_calls_total', 'counter', 'DynamoDB API calls by scope (route or CLI mode) and operation.')
+            for (scope_name, op), n in sorted(self.calls.items()):
+                out.append(f"dynamodb_calls_total{fmt_labels((('scope', scope_name), ('operation', op)))} {n}")
+            family('dynamodb_call_duration_seconds', 'histogram', 'DynamoDB call latency including SDK retries.')
+            for op, h in sorted(self.call_latency.items()):
+                histogram('dynamodb_call_duration_seconds', (('operation', op),), h)
+            family('dynamodb_errors_total', 'counter', 'DynamoDB calls that failed, by operation and error code.')
+            for (op, code), n in sorted(self.errors.items()):
+                out.append(f"dynamodb_errors_total{fmt_labels((('operation', op), ('code', code)))} {n}")
+            family('dynamodb_consumed_capacity_units_total', 'counter',
+                   'Consumed capacity units reported by DynamoDB, by scope, table, index ("" = base table) and kind.')
+            for (scope_name, table, index, kind), units in sorted(self.capacity.items()):
+                labels = (('scope', scope_name), ('table', table), ('index', index), ('kind', kind))
+                out.append(f"dynamodb_consumed_capacity_units_total{fmt_labels(labels)} {units:g}")
+        for collect in self.collectors:
+            for name, kind, help_text, samples in collect():
+                family(name, kind, help_text)
+                out.extend(f"{name}{fmt_labels(labels)} {value:g}" for labels, value in samples)
+        return '\n'.join(out) + '\n'
+
+    def summary(self):
+        """Plain dict for the CLI/loader --stats line."""
+        with self.lock:
+            calls = defaultdict(int)
+            for (_, op), n in self.calls.items():
+                calls[op] += n
+            capacity = defaultdict(float)
+            for (_, table, index, kind), units in self.capacity.items():
+                capacity[f"{table}/{index}" if index else table, kind] += units
+            return {
+                "dynamodb_calls": dict(calls),
+                "dynamodb_time_ms": {op: round(h.sum * 1000, 2) for op, h in self.call_latency.items()},
+                "consumed_capacity": {f"{name} {kind}": round(u, 2) for (name, kind), u in sorted(capacity.items())},
+                "errors": {f"{op} {code}": n for (op, code), n in self.errors.items()},
+            }
+
+def fmt_labels(labels):
+    if not labels:
+        return ''
+    esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels) + '}'
+
+def consumed(parsed):
+    """(table, index, units) from a response's ConsumedCapacity (a dict, or a list for batch ops).
+    With INDEXES the base table and each index are reported separately."""
+    entries = parsed.get('ConsumedCapacity') or []
+    for cc in entries if isinstance(entries, list) else [entries]:
+        table = cc.get('TableName', '')
+        if 'Table' not in cc and not cc.get('GlobalSecondaryIndexes') and not cc.get('LocalSecondaryIndexes'):
+            yield table, '', float(cc.get('CapacityUnits', 0))
+            continue
+        if 'Table' in cc:
+            yield table, '', float(cc['Table'].get('CapacityUnits', 0))
+        for group in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+            for index, c in (cc.get(group) or {}).items():
+                yield table, index, float(c.get('CapacityUnits', 0))
+
+registry = Registry()
+_local = threading.local()
+
+@contextmanager
+def scope(name):
+    """Attribute DynamoDB calls made on this thread to name (an API route, a CLI mode)."""
+    prev = getattr(_local, 'scope', None)
+    _local.scope = name
+    try:
+        yield
+    finally:
+        _local.scope = prev
+
+def current_scope():
+    return getattr(_local, 'scope', None) or 'other'
+
+def bind(fn):
+    """fn wrapped to run under the caller's scope, for work handed to a thread pool."""
+    name = current_scope()
+    def run(*args, **kwargs):
+        with scope(name):
+            return fn(*args, **kwargs)
+    return run
+
+def _ask_capacity(params, model, **kwargs):
+    # INDEXES still carries the overall CapacityUnits that TOTAL returns
+    if model.name in CAPACITY_OPS:
+        params['ReturnConsumedCapacity'] = 'INDEXES'
+
+def _start(context, **kwargs):
+    context['metrics_t0'] = time.perf_counter()
+
+def _finish(parsed, model, context, **kwargs):
+    t0 = context.get('metrics_t0')
+    registry.observe_call(model.name, time.perf_counter() - t0 if t0 else 0.0, parsed, current_scope())
+
+def _failed(model, exception, **kwargs):
+    registry.observe_error(model.name, type(exception).__name__)
+
+def instrument(client):
+    """Count, time and capacity-account every call made through client (a low-level client;
+    for a Table resource pass table.meta.client). Safe to call more than once."""
+    events = client.meta.events
+    events.register('before-parameter-build.dynamodb', _ask_capacity, unique_id='metrics-capacity')
+    events.register('before-call.dynamodb', _start, unique_id='metrics-start')
+    events.register('after-call.dynamodb', _finish, unique_id='metrics-finish')
+    events.register('after-call-error.dynamodb', _failed, unique_id='metrics-error')
+    return client
+
+def print_summary(file):
+    print(json.dumps({"stats": registry.summary()}), file=file)
@@ -1,14 +1,246 @@
 #!/usr/bin/env python3
 # problem2/query_papers.py
-import argparse, json, time
+import argparse, base64, binascii, heapq, itertools, json, random, sys, time, zlib
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from boto3.dynamodb.conditions import Key
+from metrics import bind, instrument, print_summary, scope
+
+BATCH_GET_MAX = 100  # BatchGetItem key limit
 
 def get_table(name, region=None):
     resource = boto3.resource('dynamodb', region_name=region) if region else boto3.resource('dynamodb')
     return resource.Table(name)
 
-def out(query_type, params, items, t0):
+def expand_body(item):
+    # compact layout stores long abstracts zlib-compressed
+    if item and 'abstract_z' in item:
+        item['abstract'] = zlib.decompress(item.pop('abstract_z').value).decode('utf-8')
+    return item
+
+_compact_tables = {}
+
+def compact_only(client, table_name):
+    """True when load_data.py recorded that every paper in the table has a PAPER#<id>/PAPER body
+    item (only --compact loads), so a body miss means the id is unknown and PaperIdIndex, which
+    is empty then, need not be asked. Read once per table per process."""
+    if table_name not in _compact_tables:
+        item = client.get_item(TableName=table_name, Key={'PK': 'TABLE#META', 'SK': 'LAYOUT'}).get('Item')
+        _compact_tables[table_name] = (item or {}).get('layout') == 'compact'
+    return _compact_tables[table_name]
+
+def fetch_paper(table, arxiv_id):
+    """Compact tables keep the body at PAPER#<id>/PAPER; older tables only have PaperIdIndex,
+    whose KEYS_ONLY entries (if any) are resolved with a second GetItem."""
+    item = table.get_item(Key={'PK': f'PAPER#{arxiv_id}', 'SK': 'PAPER'}).get('Item')
+    if item is None and not compact_only(table.meta.client, table.name):
+        items = table.query(IndexName='PaperIdIndex', KeyConditionExpression=Key('GSI2PK').eq(f'PAPER#{arxiv_id}'),
+                            Limit=1).get('Items', [])
+        item = items[0] if items else None
+        if item is not None and 'arxiv_id' not in item:
+            item = table.get_item(Key={'PK': item['PK'], 'SK': item['SK']}).get('Item')
+    return expand_body(item)
+
+def _paper_from_index(client, table_name, arxiv_id):
+    # table.meta.client: unlike the Table resource it is safe to share between threads, and it
+    # keeps the resource's plain-Python (de)serialization of attribute values
+    items = client.query(TableName=table_name, IndexName='PaperIdIndex', KeyConditionExpression=Key('GSI2PK').eq(f'PAPER#{arxiv_id}'),
+                         Limit=1).get('Items', [])
+    item = items[0] if items else None
+    if item is not None and 'arxiv_id' not in item:
+        item = client.get_item(TableName=table_name, Key={'PK': item['PK'], 'SK': item['SK']}).get('Item')
+    return expand_body(item)
+
+def fetch_papers(table, arxiv_ids, max_retries=8, base_delay=0.05, max_delay=2.0):
+    """Papers for arxiv_ids in request order, None where an id is unknown. Body items are
+    read with BatchGetItem (100 keys per call, UnprocessedKeys retried with full-jitter
+    backoff); ids without a body item fall back to PaperIdIndex lookups run in parallel,
+    unless the table is compact_only()."""
+    client = table.meta.client
+    wanted = list(dict.fromkeys(arxiv_ids))
+    found = {}
+    for i in range(0, len(wanted), BATCH_GET_MAX):
+        request = {table.name: {'Keys': [{'PK': f'PAPER#{a}', 'SK': 'PAPER'} for a in wanted[i:i + BATCH_GET_MAX]]}}
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            resp = client.batch_get_item(RequestItems=request)
+            for item in resp.get('Responses', {}).get(table.name, []):
+                item = expand_body(item)
+                found[item['PK'][len('PAPER#'):]] = item
+            request = resp.get('UnprocessedKeys') or {}
+            if not request:
+                break
+        else:
+            raise RuntimeError(f"{len(request[table.name]['Keys'])} keys still unprocessed after {max_retries} retries")
+    missing = [a for a in wanted if a not in found]
+    if missing and not compact_only(client, table.name):
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as pool:
+            for a, item in zip(missing, pool.map(bind(lambda a: _paper_from_index(client, table.name, a)), missing)):
+                if item:
+                    found[a] = item
+    return [found.get(a) for a in arxiv_ids]
+
+def encode_token(last_key):
+    """Opaque cursor for a LastEvaluatedKey (None when the result set is complete)."""
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, default=str, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_token(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError("invalid next_token") from e
+    if not isinstance(key, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in key.items()):
+        raise ValueError("invalid next_token")
+    return key
+
+def query_page(table, limit=None, next_token=None, **kwargs):
+    """One Query call: (items, next_token)."""
+    if limit:
+        kwargs['Limit'] = limit
+    if next_token:
+        kwargs['ExclusiveStartKey'] = decode_token(next_token)
+    resp = table.query(**kwargs)
+    return resp.get('Items', []), encode_token(resp.get('LastEvaluatedKey'))
+
+def paginate(table, limit=None, page_size=None, **kwargs):
+    """Yield items across pages until the query is exhausted or limit items were produced;
+    only one page is held at a time."""
+    token, produced = None, 0
+    while True:
+        want = page_size
+        if limit is not None:
+            want = min(page_size or limit, limit - produced)
+        items, token = query_page(table, want, token, **kwargs)
+        for it in items:
+            yield it
+        produced += len(items)
+        if token is None or (limit is not None and produced >= limit):
+            return
+
+class PageStream:
+    """Items of one Query in sort-key order, fetched lazily a page at a time on a shared
+    pool with the following page already in flight. Uses table.meta.client, which (unlike
+    the Table resource) is safe to call from the pool's threads."""
+    def __init__(self, pool, table, **kwargs):
+        self.pool, self.client = pool, table.meta.client
+        self.kwargs = dict(kwargs, TableName=table.name)
+        self.pending = pool.submit(bind(self.client.query), **self.kwargs)
+
+    def __iter__(self):
+        while self.pending is not None:
+            resp = self.pending.result()
+            last = resp.get('LastEvaluatedKey')
+            self.pending = self.pool.submit(bind(self.client.query), **dict(self.kwargs, ExclusiveStartKey=last)) if last else None
+            yield from resp.get('Items', [])
+
+def paper_key(item):
+    # "<date>#<id>" prefix shared by category items and every layout's author/keyword items
+    return '#'.join(item['SK'].split('#', 2)[:2])
+
+def merge_streams(streams, op='or', newest_first=True):
+    """k-way merge of streams already sorted on paper_key. 'or' yields each paper once
+    (union), 'and' only papers present in every stream (intersection). Lazy: stopping
+    early leaves the remaining pages unread."""
+    def tag(i, stream):
+        return ((paper_key(it), i, it) for it in stream)
+    tagged = [tag(i, stream) for i, stream in enumerate(streams)]
+    merged = heapq.merge(*tagged, key=lambda t: t[0], reverse=newest_first)
+    for _, group in itertools.groupby(merged, key=lambda t: t[0]):
+        group = list(group)
+        if op == 'and' and len({i for _, i, _ in group}) < len(streams):
+            continue
+        yield group[0][2]
+
+def multi_query(table, partitions, op='or', limit=20, before=None, page_size=100):
+    """Newest-first papers across several partitions, each given as (index name or None,
+    partition key attribute, values); a partition split over several key values (category
+    shards) is read as one stream. Combined with op. Returns (items, next_before);
+    next_before is the paper_key to pass back as before= for the following page."""
+    with ThreadPoolExecutor(max_workers=sum(len(values) for _, _, values in partitions)) as pool:
+        streams = []
+        for index, attr, values in partitions:
+            kwargs = {'IndexName': index} if index else {}
+            shards = []
+            for value in values:
+                cond = Key(attr).eq(value)
+                if before:
+                    cond = cond & Key('SK').lt(before)
+                shards.append(PageStream(pool, table, KeyConditionExpression=cond, ScanIndexForward=False,
+                                         Limit=page_size, **kwargs))
+            streams.append(shards[0] if len(shards) == 1 else heapq.merge(*shards, key=paper_key, reverse=True))
+        results = merge_streams(streams, op)
+        items = list(itertools.islice(results, limit))
+        results.close()
+    return items, (paper_key(items[-1]) if len(items) == limit and items else None)
+
+def keyword_partitions(terms):
+    return [('KeywordIndex', 'GSI3PK', [f'KEYWORD#{t.lower()}']) for t in dict.fromkeys(terms)]
+
+def category_keys(category, shards=1):
+    """Partition keys holding one category; must match the loader's --category-shards."""
+    if shards <= 1:
+        return [f'CATEGORY#{category}']
+    return [f'CATEGORY#{category}#{n}' for n in range(shards)]
+
+def category_partitions(categories, shards=1):
+    return [(None, 'PK', category_keys(c, shards)) for c in dict.fromkeys(categories)]
+
+def scatter_gather(table, keys, newest_first=True, after=None, page_size=None, sk_condition=None):
+    """Items of several base-table partitions (category shards) merged on SK, newest first
+    unless newest_first is False. All partitions are queried in parallel with their next page
+    prefetched; after= is the SK of the last item already returned, which every partition
+    resumes behind. Lazy: closing the generator leaves the remaining pages unread."""
+    with ThreadPoolExecutor(max_workers=len(keys)) as pool:
+        streams = []
+        for pk in keys:
+            cond = Key('PK').eq(pk)
+            if sk_condition is not None:
+                cond = cond & sk_condition
+            kwargs = {'Limit': page_size} if page_size else {}
+            if after:
+                kwargs['ExclusiveStartKey'] = {'PK': pk, 'SK': after}
+            streams.append(PageStream(pool, table, KeyConditionExpression=cond, ScanIndexForward=not newest_first, **kwargs))
+        yield from heapq.merge(*streams, key=lambda it: it['SK'], reverse=newest_first)
+
+def category_page(table, category, shards, limit, next_token=None, newest_first=True, sk_condition=None):
+    """query_page() for a category: a plain Query when it is one partition, else one
+    scatter-gather page whose next_token carries the last SK, issued only while more items remain."""
+    if shards <= 1:
+        cond = Key('PK').eq(f'CATEGORY#{category}')
+        if sk_condition is not None:
+            cond = cond & sk_condition
+        return query_page(table, limit, next_token, KeyConditionExpression=cond, ScanIndexForward=not newest_first)
+    after = None
+    if next_token:
+        after = decode_token(next_token).get('SK')
+        if after is None:
+            raise ValueError("invalid next_token")
+    # one item past the page says whether another page exists, so a last page that is exactly
+    # limit long ends without a token (and without a scatter-gather that finds nothing)
+    results = scatter_gather(table, category_keys(category, shards), newest_first, after, limit + 1, sk_condition)
+    items = list(itertools.islice(results, limit + 1))
+    results.close()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_token({'SK': items[-1]['SK']})
+
+def out(query_type, params, items, t0, ndjson=False):
+    if ndjson:
+        # one line per item as pages arrive; the summary goes to stderr
+        count = 0
+        for it in items:
+            print(json.dumps(it, default=str), flush=False)
+            count += 1
+        sys.stdout.flush()
+        print(json.dumps({"query_type": query_type, "parameters": params, "count": count,
+                          "execution_time_ms": round((time.time()-t0)*1000,2)}), file=sys.stderr)
+        return
+    items = list(items)
     print(json.dumps({
         "query_type": query_type,
         "parameters": params,
@@ -17,56 +249,96 @@ def out(query_type, params, items, t0):
         "execution_time_ms": round((time.time()-t0)*1000,2)
     }, default=str))
 
-def query_recent_in_category(table, category, limit):
+def query_recent_in_category(table, category, limit, ndjson=False, page_size=None, shards=1):
+    t0=time.time()
+    if shards > 1:
+        # no shard can contribute more than limit items
+        items = itertools.islice(scatter_gather(table, category_keys(category, shards), page_size=page_size or limit), limit)
+    else:
+        items = paginate(table, limit, page_size, KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}'), ScanIndexForward=False)
+    out("recent_in_category", {"category":category, "limit":limit}, items, t0, ndjson)
+
+def query_papers_by_author(table, author, ndjson=False, page_size=None):
+    t0=time.time()
+    items = paginate(table, None, page_size, IndexName='AuthorIndex', KeyConditionExpression=Key('GSI1PK').eq(f'AUTHOR#{author}'))
+    out("papers_by_author", {"author":author}, items, t0, ndjson)
+
+def get_paper_by_id(table, arxiv_id, ndjson=False):
     t0=time.time()
-    resp = table.query(KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}'), ScanIndexForward=False, Limit=limit)
-    out("recent_in_category", {"category":category, "limit":limit}, resp.get('Items',[]), t0)
+    item = fetch_paper(table, arxiv_id)
+    out("get_by_id", {"arxiv_id":arxiv_id}, [item] if item else [], t0, ndjson)
 
-def query_papers_by_author(table, author):
+def get_papers_by_ids(table, arxiv_ids, ndjson=False):
     t0=time.time()
-    resp = table.query(IndexName='AuthorIndex', KeyConditionExpression=Key('GSI1PK').eq(f'AUTHOR#{author}'))
-    out("papers_by_author", {"author":author}, resp.get('Items',[]), t0)
+    items = fetch_papers(table, arxiv_ids)
+    missing = [a for a, it in zip(arxiv_ids, items) if it is None]
+    out("get_by_ids", {"arxiv_ids":arxiv_ids, "missing":missing}, [it for it in items if it is not None], t0, ndjson)
 
-def get_paper_by_id(table, arxiv_id):
+def query_papers_in_date_range(table, category, start_date, end_date, ndjson=False, page_size=None, shards=1):
     t0=time.time()
-    resp = table.query(IndexName='PaperIdIndex', KeyConditionExpression=Key('GSI2PK').eq(f'PAPER#{arxiv_id}'))
-    out("get_by_id", {"arxiv_id":arxiv_id}, resp.get('Items',[]), t0)
+    dates = Key('SK').between(f'{start_date}#', f'{end_date}#zzzzzzz')
+    if shards > 1:
+        # oldest first like the single-partition Query
+        items = scatter_gather(table, category_keys(category, shards), newest_first=False, page_size=page_size, sk_condition=dates)
+    else:
+        items = paginate(table, None, page_size, KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}') & dates)
+    out("date_range", {"category":category,"start_date":start_date,"end_date":end_date}, items, t0, ndjson)
 
-def query_papers_in_date_range(table, category, start_date, end_date):
+def query_papers_by_keyword(table, keyword, limit, ndjson=False, page_size=None):
     t0=time.time()
-    resp = table.query(KeyConditionExpression=Key('PK').eq(f'CATEGORY#{category}') & Key('SK').between(f'{start_date}#', f'{end_date}#zzzzzzz'))
-    out("date_range", {"category":category,"start_date":start_date,"end_date":end_date}, resp.get('Items',[]), t0)
+    items = paginate(table, limit, page_size, IndexName='KeywordIndex',
+                     KeyConditionExpression=Key('GSI3PK').eq(f'KEYWORD#{keyword.lower()}'), ScanIndexForward=False)
+    out("keyword", {"keyword":keyword, "limit":limit}, items, t0, ndjson)
 
-def query_papers_by_keyword(table, keyword, limit):
+def query_multi(table, kind, values, op, limit, before=None, ndjson=False, shards=1):
     t0=time.time()
-    resp = table.query(IndexName='KeywordIndex', KeyConditionExpression=Key('GSI3PK').eq(f'KEYWORD#{keyword.lower()}'),
-                       ScanIndexForward=False, Limit=limit)
-    out("keyword", {"keyword":keyword, "limit":limit}, resp.get('Items',[]), t0)
+    parts = keyword_partitions(values) if kind == 'keywords' else category_partitions(values, shards)
+    items, next_before = multi_query(table, parts, op, limit, before)
+    out(f"multi_{kind}", {kind: values, "op": op, "limit": limit, "before": before, "next_before": next_before}, items, t0, ndjson)
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("mode", choices=["recent","author","get","daterange","keyword"])
+    ap.add_argument("mode", choices=["recent","author","get","daterange","keyword","keywords","categories"])
     ap.add_argument("arg1")
-    ap.add_argument("arg2", nargs='?')
-    ap.add_argument("arg3", nargs='?')
+    ap.add_argument("rest", nargs='*', help="daterange: <start_date> <end_date>; get: more arXiv ids; keywords/categories: more values")
     ap.add_argument("--table", default="arxiv-papers")
     ap.add_argument("--region", default=None)
     ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--ndjson", action="store_true", help="Stream one JSON item per line while paging (summary on stderr)")
+    ap.add_argument("--page-size", type=int, default=None, help="Items per Query request (default: DynamoDB's 1 MB pages)")
+    ap.add_argument("--op", choices=["and", "or"], default="or", help="keywords/categories: intersection or union")
+    ap.add_argument("--before", default=None, help="keywords/categories: only papers older than this <date>#<id> (next_before)")
+    ap.add_argument("--category-shards", type=int, default=1,
+                    help="recent/daterange/categories: shards per category, as loaded with load_data.py --category-shards")
+    ap.add_argument("--stats", action="store_true",
+                    help="Print DynamoDB call counts, time and consumed capacity per table/GSI to stderr")
     args = ap.parse_args()
     table = get_table(args.table, args.region)
+    if args.stats:
+        instrument(table.meta.client)
+    if args.mode == "daterange" and len(args.rest) != 2:
+        raise SystemExit("daterange requires <category> <start_date> <end_date>")
 
-    if args.mode == "recent":
-        query_recent_in_category(table, args.arg1, args.limit)
-    elif args.mode == "author":
-        query_papers_by_author(table, args.arg1)
-    elif args.mode == "get":
-        get_paper_by_id(table, args.arg1)
-    elif args.mode == "daterange":
-        if args.arg2 is None or args.arg3 is None:
-            raise SystemExit("daterange requires <category> <start_date> <end_date>")
-        query_papers_in_date_range(table, args.arg1, args.arg2, args.arg3)
-    elif args.mode == "keyword":
-        query_papers_by_keyword(table, args.arg1, args.limit)
+    with scope(args.mode):
+        if args.mode == "recent":
+            query_recent_in_category(table, args.arg1, args.limit, args.ndjson, args.page_size, args.category_shards)
+        elif args.mode == "author":
+            query_papers_by_author(table, args.arg1, args.ndjson, args.page_size)
+        elif args.mode == "get":
+            if args.rest:
+                get_papers_by_ids(table, [args.arg1] + args.rest, args.ndjson)
+            else:
+                get_paper_by_id(table, args.arg1, args.ndjson)
+        elif args.mode == "daterange":
+            query_papers_in_date_range(table, args.arg1, args.rest[0], args.rest[1], args.ndjson, args.page_size,
+                                       args.category_shards)
+        elif args.mode == "keyword":
+            query_papers_by_keyword(table, args.arg1, args.limit, args.ndjson, args.page_size)
+        elif args.mode in ("keywords", "categories"):
+            values = [v for v in (args.arg1.split(',') + args.rest) if v]
+            query_multi(table, args.mode, values, args.op, args.limit, args.before, args.ndjson, args.category_shards)
+    if args.stats:
+        print_summary(sys.stderr)
 
 if __name__ == "__main__":
     main()